@@ -0,0 +1,108 @@
+# A compiled form of a fitted scikit-learn decision tree that scores with NumPy only. The tree is
+# flattened into parallel arrays indexed by node, and a batch is scored by advancing every row one
+# level per iteration, so serving this form does not need to import scikit-learn.
+
+from __future__ import print_function
+
+import numpy as np
+
+TREE_LEAF = -1  # Child index of the leaves, as in sklearn.tree._tree
+
+
+class FlatTree(object):
+    """A decision tree flattened into parallel node arrays.
+
+    Args:
+        feature (int array): The feature tested at each node.
+        threshold (float array): The threshold a row goes left at or below.
+        left (int array): The left child of each node, TREE_LEAF for leaves.
+        right (int array): The right child of each node, TREE_LEAF for leaves.
+        leaf_class (int array): The index into classes predicted at each node.
+        classes (array): The class labels.
+        depth (int): The depth of the tree.
+        n_features (int): The row width the tree was fitted on, None if unknown."""
+
+    def __init__(self, feature, threshold, left, right, leaf_class, classes, depth, n_features=None):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.leaf_class = leaf_class
+        self.classes = classes
+        self.depth = int(depth)
+        self.n_features = None if n_features is None else int(n_features)
+
+        # Scoring layout: leaves loop back to themselves so every row can take exactly `depth` steps,
+        # and both children of a node sit next to each other so a step is a single gather.
+        nodes = np.arange(len(left))
+        leaf = left == TREE_LEAF
+        self.children = np.stack([np.where(leaf, nodes, left), np.where(leaf, nodes, right)], axis=1).ravel()
+        self.children = self.children.astype(np.int32)
+        self.node_feature = np.where(leaf, 0, feature).astype(np.int32)
+        # scikit-learn compares float32 rows against float64 thresholds. Rounding every threshold down
+        # to the nearest float32 gives the same decisions with a float32 comparison.
+        node_threshold = threshold.astype(np.float32)
+        too_high = node_threshold.astype(np.float64) > threshold
+        node_threshold[too_high] = np.nextafter(node_threshold[too_high], np.float32(-np.inf))
+        self.node_threshold = node_threshold
+
+    @classmethod
+    def compile(cls, clf):
+        """Flatten a fitted DecisionTreeClassifier with a single output."""
+        tree = clf.tree_
+        if tree.n_outputs != 1:
+            raise ValueError("Only single output trees can be compiled")
+        classes = np.asarray(clf.classes_)
+        if classes.dtype == object:
+            classes = classes.astype(str)
+        return cls(
+            tree.feature.astype(np.int32),
+            tree.threshold.astype(np.float64),
+            tree.children_left.astype(np.int32),
+            tree.children_right.astype(np.int32),
+            tree.value[:, 0, :].argmax(axis=1).astype(np.int32),
+            classes,
+            tree.max_depth,
+            getattr(clf, "n_features_in_", getattr(clf, "n_features_", tree.n_features)),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls(
+                *(arrays[name] for name in ["feature", "threshold", "left", "right", "leaf_class", "classes", "depth"]),
+                # Trees saved before the width was recorded
+                n_features=arrays["n_features"] if "n_features" in arrays.files else None,
+            )
+
+    def save(self, path):
+        np.savez(
+            path,
+            feature=self.feature,
+            threshold=self.threshold,
+            left=self.left,
+            right=self.right,
+            leaf_class=self.leaf_class,
+            classes=self.classes,
+            depth=self.depth,
+            n_features=self.n_features,
+        )
+
+    def predict(self, input):
+        """Predict the class of every row, advancing all the rows one level per iteration."""
+        X = np.ascontiguousarray(input, dtype=np.float32)
+        # Without this, extra columns are ignored and missing ones only fail on the rows that reach them
+        if X.ndim != 2 or (self.n_features is not None and X.shape[1] != self.n_features):
+            raise ValueError(
+                "Expected rows of {} features, got an array of shape {}".format(self.n_features, X.shape)
+            )
+        # NaN would go left at every split, scikit-learn rejects NaN and infinity as well
+        if not np.isfinite(X).all():
+            raise ValueError("Input contains NaN or infinity")
+        values = X.ravel()
+        row_offsets = np.arange(X.shape[0], dtype=np.int32) * X.shape[1]
+        node = np.zeros(X.shape[0], dtype=np.int32)
+        for _ in range(self.depth):
+            go_right = values.take(row_offsets + self.node_feature.take(node)) > self.node_threshold.take(node)
+            node = self.children.take(2 * node + go_right)
+        return self.classes.take(self.leaf_class.take(node))
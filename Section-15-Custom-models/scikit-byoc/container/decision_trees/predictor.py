@@ -3,46 +3,424 @@
 
 from __future__ import print_function
 
+import collections
 import io
 import json
 import os
 import pickle
+import re
 import signal
 import sys
+import threading
+import time
 import traceback
 
 import flask
+import numpy as np
 import pandas as pd
+from flat_tree import FlatTree
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
 
 prefix = "/opt/ml/"
 model_path = os.path.join(prefix, "model")
 
+# Scoring engine: "sklearn" unpickles decision-tree-model.pkl, "flat" scores the tree compiled to
+# NumPy arrays, loaded from decision-tree-model.npz (written by train) without importing scikit-learn
+scoring_engine = os.environ.get("MODEL_SERVER_ENGINE", "sklearn").lower()
+
+# Stream CSV bodies through the model block by block, e.g. for SageMaker Batch Transform
+streaming_enabled = (
+    os.environ.get("MODEL_SERVER_STREAMING", os.environ.get("SAGEMAKER_BATCH", "false")).lower() == "true"
+)
+stream_block_rows = int(os.environ.get("MODEL_SERVER_STREAM_BLOCK_ROWS", 1024))
+stream_chunk_bytes = 64 * 1024
+
+# Multi-model hosting: requests name a model with the X-Amzn-SageMaker-Target-Model header or the
+# /models/<name>/invoke path, and each model is loaded on demand from its own folder under
+# MODEL_SERVER_MODELS_PATH into a bounded LRU pool of each worker
+multi_model_enabled = os.environ.get("MODEL_SERVER_MULTI_MODEL", "false").lower() == "true"
+models_path = os.environ.get("MODEL_SERVER_MODELS_PATH", os.path.join(prefix, "models"))
+pool_max_models = int(os.environ.get("MODEL_SERVER_POOL_MAX_MODELS", 100))
+pool_max_bytes = int(os.environ.get("MODEL_SERVER_POOL_MAX_BYTES", 1024 * 1024 * 1024))
+model_name_pattern = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]*$")
+
+# Seconds between checks of the model folder for a new model version, 0 disables hot reload.
+# POST /reload touches reload_stamp_path to make every worker reload.
+reload_interval = float(os.environ.get("MODEL_SERVER_RELOAD_INTERVAL", 0))
+reload_stamp_path = "/tmp/model-reload"
+
+# Per-stage latency, request and payload metrics. The gunicorn workers write them to
+# PROMETHEUS_MULTIPROC_DIR (set by serve) and /metrics aggregates them across workers.
+latency_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+stage_latency = Histogram(
+    "inference_stage_latency_seconds", "Latency of each invocation stage", ["stage"], buckets=latency_buckets
+)
+request_count = Counter("inference_requests_total", "Invocation requests by status code", ["status"])
+row_count = Counter("inference_rows_total", "Records scored by invocation requests")
+payload_size = Histogram(
+    "inference_payload_bytes",
+    "Size of invocation payloads",
+    ["direction"],
+    buckets=tuple(4 ** power for power in range(3, 14)),
+)
+in_flight_requests = Gauge(
+    "inference_in_flight_requests", "Invocation requests being processed", multiprocess_mode="livesum"
+)
+pool_latency = Histogram(
+    "model_pool_latency_seconds",
+    "Latency of model pool loads and evictions",
+    ["operation"],
+    buckets=latency_buckets + (30, 60),
+)
+pool_models = Gauge("model_pool_models", "Models held by the model pools", multiprocess_mode="livesum")
+pool_bytes = Gauge("model_pool_bytes", "Size of the model files held by the model pools", multiprocess_mode="livesum")
+
+
+reload_latency = Histogram(
+    "model_reload_seconds", "Latency of loading and warming a reloaded model", buckets=latency_buckets + (30, 60)
+)
+reload_count = Counter("model_reloads_total", "Model hot reloads by outcome", ["status"])
+
+
+class ModelNotFoundError(LookupError):
+    pass
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+
+class ModelPool(object):
+    """Models loaded on demand from their folder under root and held least recently used first,
+    within max_models models and max_bytes of model files. The load and eviction latencies are
+    recorded in model_pool_latency_seconds.
+
+    Args:
+        root (str): The folder with one sub-folder of model artifacts per model name.
+        loader (function): Loads the model in a folder.
+        max_models (int): The maximum number of models held.
+        max_bytes (int): The maximum size of the model files held, which approximates memory."""
+
+    def __init__(self, root, loader, max_models, max_bytes):
+        self.root = root
+        self.loader = loader
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.models = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # One lock per model being loaded, so concurrent requests load it once
+        self.loading = {}
+
+    def path(self, name):
+        if not model_name_pattern.match(name):
+            raise ValueError("Invalid model name '{}'.".format(name))
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(path):
+            raise ModelNotFoundError("Model '{}' not found.".format(name))
+        return path
+
+    def lookup(self, name):
+        entry = self.models.get(name)
+        if entry is None:
+            return None
+        self.models.move_to_end(name)
+        self.hits += 1
+        return entry[0]
+
+    def get(self, name):
+        """Get a model by name, loading it and evicting the least recently used models if needed."""
+        with self.lock:
+            model = self.lookup(name)
+            if model is not None:
+                return model
+        # Invalid and unknown names fail here, before they take a loading entry
+        path = self.path(name)
+        with self.lock:
+            loading = self.loading.setdefault(name, threading.Lock())
+        try:
+            with loading:
+                with self.lock:
+                    model = self.lookup(name)
+                    if model is not None:
+                        return model
+                with pool_latency.labels("load").time():
+                    started = time.perf_counter()
+                    model = self.loader(path)
+                    elapsed = time.perf_counter() - started
+                size = directory_size(path)
+                with self.lock:
+                    self.models[name] = (model, size)
+                    self.size += size
+                    self.loads += 1
+                    pool_models.inc()
+                    pool_bytes.inc(size)
+                    self.evict()
+        finally:
+            # Also after a failed load, so that the entry never outlives its load
+            with self.lock:
+                if self.loading.get(name) is loading:
+                    del self.loading[name]
+        print(
+            "Loaded model '{}' ({:.1f}MB) in {:.1f} ms. Model pool stats: {}".format(
+                name, size / (1024 * 1024), 1000 * elapsed, json.dumps(self.stats())
+            )
+        )
+        return model
+
+    def evict(self):
+        """Evict the least recently used models over the limits. Called with the lock held, and
+        always keeps the model just loaded."""
+        while len(self.models) > 1 and (len(self.models) > self.max_models or self.size > self.max_bytes):
+            with pool_latency.labels("evict").time():
+                started = time.perf_counter()
+                # Trees hold no reference cycles, so dropping the reference frees them
+                name, (model, size) = self.models.popitem(last=False)
+                del model
+                elapsed = time.perf_counter() - started
+            self.size -= size
+            self.evictions += 1
+            pool_models.dec()
+            pool_bytes.dec(size)
+            print("Evicted model '{}' ({:.1f}MB) in {:.1f} ms.".format(name, size / (1024 * 1024), 1000 * elapsed))
+
+    def stats(self):
+        return {
+            "models": len(self.models),
+            "bytes": self.size,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+def model_signature(path):
+    """Return the name, modification time and size of every model file, plus the reload stamp."""
+    signature = []
+    for root, _, files in os.walk(path):
+        for file in sorted(files):
+            stat = os.stat(os.path.join(root, file))
+            signature.append((os.path.join(root, file), stat.st_mtime_ns, stat.st_size))
+    if os.path.exists(reload_stamp_path):
+        signature.append((reload_stamp_path, os.stat(reload_stamp_path).st_mtime_ns, 0))
+    return signature
+
+
+class ModelReloader(object):
+    """Polls the model folder of a worker every interval seconds. Once the model files changed and
+    stayed the same for one more poll, so that a copy in progress is not read, the new model is
+    loaded and warmed on this thread and handed to swap_fn. Requests already running keep the model
+    they started with, which is freed once they finish.
+
+    Args:
+        path (str): The model folder to watch.
+        interval (float): The seconds between polls.
+        swap_fn (function): Installs the new model."""
+
+    def __init__(self, path, interval, swap_fn):
+        self.path = path
+        self.interval = interval
+        self.swap_fn = swap_fn
+        self.pid = os.getpid()
+        self.loaded = model_signature(path)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        pending = None
+        while True:
+            time.sleep(self.interval)
+            try:
+                current = model_signature(self.path)
+            except OSError:
+                # Files replaced while listing them
+                continue
+            if current == self.loaded or current != pending:
+                pending = None if current == self.loaded else current
+                continue
+            self.reload(current)
+            pending = None
+
+    def reload(self, signature):
+        started = time.perf_counter()
+        try:
+            with reload_latency.time():
+                model = load_model()
+                warm_model(model)
+        except Exception:
+            # Keep serving the current model until the files change again
+            reload_count.labels("failure").inc()
+            print("Model reload failed, keeping the current model:\n" + traceback.format_exc())
+        else:
+            self.swap_fn(model)
+            reload_count.labels("success").inc()
+            print("Model reloaded and warmed in {:.2f} seconds.".format(time.perf_counter() - started))
+        self.loaded = signature
+
+
 # A singleton for holding the model. This simply loads the model and holds it.
 # It has a predict function that does a prediction based on the model and the input data.
 
 
 class ScoringService(object):
     model = None  # Where we keep the model when it's loaded
+    pool = None  # Where we keep the named models in multi-model mode
+    reloader = None  # Watches the model folder when hot reload is enabled
 
     @classmethod
-    def get_model(cls):
-        """Get the model object for this instance, loading it if it's not already loaded."""
+    def get_model(cls, model_name=None):
+        """Get the model object for this instance, loading it if it's not already loaded.
+
+        Args:
+            model_name (str): The name of the model in multi-model mode, None for the single model."""
+        if model_name is not None:
+            if cls.pool is None:
+                cls.pool = ModelPool(models_path, load_model, pool_max_models, pool_max_bytes)
+            return cls.pool.get(model_name)
         if cls.model == None:
-            with open(os.path.join(model_path, "decision-tree-model.pkl"), "rb") as inp:
-                cls.model = pickle.load(inp)
+            cls.model = load_model()
+        if reload_interval > 0 and (cls.reloader is None or cls.reloader.pid != os.getpid()):
+            # Started in the serving worker, threads do not survive the fork of the gunicorn master
+            cls.reloader = ModelReloader(model_path, reload_interval, cls.swap)
         return cls.model
 
     @classmethod
-    def predict(cls, input):
+    def swap(cls, model):
+        """Install a new model with a single reference assignment, so that every request sees
+        either the old or the new model."""
+        cls.model = model
+
+    @classmethod
+    def predict(cls, input, model_name=None):
         """For the input, do the predictions and return them.
 
         Args:
-            input (a pandas dataframe): The data on which to do the predictions. There will be
-                one prediction per row in the dataframe"""
-        clf = cls.get_model()
+            input (a float array or pandas dataframe): The data on which to do the predictions. There
+                will be one prediction per row
+            model_name (str): The name of the model in multi-model mode, None for the single model."""
+        clf = cls.get_model(model_name)
         return clf.predict(input)
 
 
+def csv_blocks(stream, block_rows, chunk_bytes=stream_chunk_bytes):
+    """Read a CSV body in chunks and yield it as blocks of complete records, so that memory stays
+    flat regardless of the payload size.
+
+    Args:
+        stream (file): The readable request body stream.
+        block_rows (int): The number of records per block.
+        chunk_bytes (int): The number of bytes read from the stream at a time."""
+    remainder = b""
+    rows = []
+    while True:
+        chunk = stream.read(chunk_bytes)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(b"\n")
+        # The last line may continue in the next chunk
+        remainder = lines.pop()
+        rows.extend(line for line in lines if line.strip())
+        while len(rows) >= block_rows:
+            yield b"\n".join(rows[:block_rows])
+            rows = rows[block_rows:]
+    if remainder.strip():
+        rows.append(remainder)
+    if rows:
+        yield b"\n".join(rows)
+
+
+class CountingReader(object):
+    """Count the bytes read from a request body stream, for the payload size metric."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.size += len(chunk)
+        return chunk
+
+
+def csv_to_array(body):
+    """Parse a purely numeric CSV body straight into a contiguous float array, without pandas.
+
+    Args:
+        body (bytes): The CSV body with one record per line.
+
+    Returns:
+        A 2-D float array with one row per record, or None if the body is not purely numeric, in
+        which case it needs the pandas parser.
+
+    Raises:
+        ValueError: If the records differ in width, which pandas would silently pad with NaN."""
+    rows = [row for row in body.split(b"\n") if row.strip()]
+    # Quoted fields may hold separators, only pandas can count their fields
+    if len(rows) == 0 or b'"' in body:
+        return None
+    widths = [row.count(b",") + 1 for row in rows]
+    for index, width in enumerate(widths):
+        if width != widths[0]:
+            raise ValueError(
+                "Every record must contain {} fields, record {} has {}.".format(widths[0], index + 1, width)
+            )
+    width = widths[0]
+    try:
+        values = np.fromstring(b",".join(rows).decode("utf-8"), sep=",")
+    except ValueError:
+        return None
+    if values.size != len(rows) * width:
+        return None
+    return values.reshape(len(rows), width)
+
+
+def parse_csv(body):
+    """Parse a CSV body with the fast numeric path, falling back to pandas for anything else."""
+    data = csv_to_array(body)
+    if data is None:
+        data = pd.read_csv(io.BytesIO(body), header=None)
+    return data
+
+
+def format_csv(predictions):
+    """Format the predictions as CSV, one per line, without building a DataFrame."""
+    return "".join(str(value) + "\n" for value in predictions)
+
+
+def load_model(path=None):
+    """Load the model in a folder for the configured scoring engine, by default the model folder."""
+    path = model_path if path is None else path
+    if scoring_engine == "flat" and os.path.exists(os.path.join(path, "decision-tree-model.npz")):
+        return FlatTree.load(os.path.join(path, "decision-tree-model.npz"))
+    with open(os.path.join(path, "decision-tree-model.pkl"), "rb") as inp:
+        model = pickle.load(inp)
+    if scoring_engine == "flat":
+        # Models trained before the compile step only ship the pickle
+        model = FlatTree.compile(model)
+    return model
+
+
+def warm_model(model):
+    """Score one row of zeros, so that the first request does not pay for any lazy initialization."""
+    if isinstance(model, FlatTree):
+        width = model.n_features if model.n_features is not None else int(model.feature.max()) + 1
+    else:
+        width = getattr(model, "n_features_in_", getattr(model, "n_features_", 1))
+    model.predict(np.zeros((1, max(width, 1)), dtype=np.float32))
+
+
 # The flask app for serving predictions
 app = flask.Flask(__name__)
 
@@ -51,38 +429,157 @@ app = flask.Flask(__name__)
 def ping():
     """Determine if the container is working and healthy. In this sample container, we declare
     it healthy if we can load the model successfully."""
-    health = ScoringService.get_model() is not None  # You can insert a health check here
+    if multi_model_enabled:
+        # Models are loaded by the requests that name them
+        health = os.path.isdir(models_path)
+    else:
+        health = ScoringService.get_model() is not None  # You can insert a health check here
 
     status = 200 if health else 404
     return flask.Response(response="\n", status=status, mimetype="application/json")
 
 
+@app.route("/reload", methods=["POST"])
+def reload():
+    """Make every worker reload the model at its next poll of the model folder."""
+    if reload_interval <= 0:
+        return flask.Response(
+            response="Hot reload is not enabled, set MODEL_SERVER_RELOAD_INTERVAL.", status=400, mimetype="text/plain"
+        )
+    with open(reload_stamp_path, "a"):
+        os.utime(reload_stamp_path)
+    return flask.Response(response="\n", status=202, mimetype="application/json")
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Expose the invocation metrics of all the workers in the Prometheus text format."""
+    registry = REGISTRY
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return flask.Response(response=generate_latest(registry), status=200, mimetype=CONTENT_TYPE_LATEST)
+
+
+def target_model(name):
+    """Resolve the model named by a request in multi-model mode.
+
+    Args:
+        name (str): The X-Amzn-SageMaker-Target-Model header or the name in the path.
+
+    Returns:
+        The model name, or None to score with the single model."""
+    if not name:
+        return None
+    if not multi_model_enabled:
+        raise ModelNotFoundError("Multi-model mode is not enabled, set MODEL_SERVER_MULTI_MODEL=true.")
+    # SageMaker multi-model endpoints name the model by its artifact, e.g. "customer-a.tar.gz"
+    return name[: -len(".tar.gz")] if name.endswith(".tar.gz") else name
+
+
 @app.route("/invocations", methods=["POST"])
-def transformation():
+@app.route("/models/<model_name>/invoke", methods=["POST"])
+def transformation(model_name=None):
     """Do an inference on a single batch of data. In this sample server, we take data as CSV, convert
-    it to a pandas data frame for internal use and then convert the predictions back to CSV (which really
-    just means one prediction per line, since there's a single column.
+    it to a float array (or a pandas data frame if it is not purely numeric) for internal use and then
+    convert the predictions back to CSV (which really just means one prediction per line, since there's
+    a single column.
     """
+    with in_flight_requests.track_inprogress():
+        try:
+            response = score_request(model_name or flask.request.headers.get("X-Amzn-SageMaker-Target-Model"))
+        except Exception:
+            request_count.labels(500).inc()
+            raise
+    request_count.labels(response.status_code).inc()
+    return response
+
+
+def score_request(model_name=None):
+    """Score the current request, recording the latency of each stage."""
     data = None
 
-    # Convert from CSV to pandas
+    try:
+        # Load a named model before reading the body, so that a missing model is a 404
+        model_name = target_model(model_name)
+        if model_name is not None:
+            ScoringService.get_model(model_name)
+    except ValueError as e:
+        return flask.Response(response=str(e), status=400, mimetype="text/plain")
+    except ModelNotFoundError as e:
+        return flask.Response(response=str(e), status=404, mimetype="text/plain")
+
+    if streaming_enabled and flask.request.content_type == "text/csv":
+        return stream_request(model_name)
+
+    # Convert from CSV to a float array, or to pandas for non-numeric data
     if flask.request.content_type == "text/csv":
-        data = flask.request.data.decode("utf-8")
-        s = io.StringIO(data)
-        data = pd.read_csv(s, header=None)
+        with stage_latency.labels("read").time():
+            data = flask.request.data
+        payload_size.labels("request").observe(len(data))
+        try:
+            with stage_latency.labels("parse").time():
+                data = parse_csv(data)
+        except ValueError as e:
+            return flask.Response(response=str(e), status=400, mimetype="text/plain")
     else:
         return flask.Response(
             response="This predictor only supports CSV data", status=415, mimetype="text/plain"
         )
 
     print("Invoked with {} records".format(data.shape[0]))
+    row_count.inc(data.shape[0])
 
-    # Do the prediction
-    predictions = ScoringService.predict(data)
+    # Do the prediction, records of the wrong width are the client's error
+    try:
+        with stage_latency.labels("predict").time():
+            predictions = ScoringService.predict(data, model_name)
+    except ValueError as e:
+        return flask.Response(response=str(e), status=400, mimetype="text/plain")
 
     # Convert from numpy back to CSV
-    out = io.StringIO()
-    pd.DataFrame({"results": predictions}).to_csv(out, header=False, index=False)
-    result = out.getvalue()
+    with stage_latency.labels("serialize").time():
+        result = format_csv(predictions)
+    payload_size.labels("response").observe(len(result))
 
     return flask.Response(response=result, status=200, mimetype="text/csv")
+
+
+def stream_request(model_name=None):
+    """Score the body block by block as it is read and stream the results back with chunked
+    transfer encoding, so that Batch Transform sized payloads never sit in memory at once. The
+    first block is scored before the response starts, so that a malformed body is still a 400."""
+    body = CountingReader(flask.request.stream)
+    blocks = csv_blocks(body, stream_block_rows)
+
+    def score_block(block):
+        with stage_latency.labels("parse").time():
+            data = parse_csv(block)
+        row_count.inc(data.shape[0])
+        with stage_latency.labels("predict").time():
+            predictions = ScoringService.predict(data, model_name)
+        with stage_latency.labels("serialize").time():
+            return format_csv(predictions)
+
+    def next_block():
+        with stage_latency.labels("read").time():
+            return next(blocks, None)
+
+    try:
+        block = next_block()
+        first = "" if block is None else score_block(block)
+    except ValueError as e:
+        return flask.Response(response=str(e), status=400, mimetype="text/plain")
+
+    def generate(result, block):
+        response_size = 0
+        while block is not None:
+            response_size += len(result)
+            yield result
+            block = next_block()
+            if block is not None:
+                result = score_block(block)
+        payload_size.labels("request").observe(body.size)
+        payload_size.labels("response").observe(response_size)
+
+    return flask.Response(flask.stream_with_context(generate(first, block)), status=200, mimetype="text/csv")
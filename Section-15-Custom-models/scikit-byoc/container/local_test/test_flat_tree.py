@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Parity and speed check of the compiled flat tree against scikit-learn, using the training data in
+# test_dir. Run it from this directory with: python test_flat_tree.py
+
+from __future__ import print_function
+
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn import tree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "decision_trees"))
+from flat_tree import FlatTree
+
+training_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_dir/input/data/training/iris.csv")
+
+
+def main():
+    data = pd.read_csv(training_file, header=None)
+    train_X, train_y = data.iloc[:, 1:].to_numpy(), data.iloc[:, 0].to_numpy()
+
+    # Rows around the training data, plus the training rows themselves to hit thresholds exactly
+    rng = np.random.RandomState(0)
+    low, high = train_X.min(axis=0) - 1, train_X.max(axis=0) + 1
+    test_X = np.vstack([train_X, rng.uniform(low, high, size=(200000, train_X.shape[1]))])
+
+    for max_leaf_nodes in [None, 2, 3, 8]:
+        clf = tree.DecisionTreeClassifier(max_leaf_nodes=max_leaf_nodes, random_state=0).fit(train_X, train_y)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "decision-tree-model.npz")
+            FlatTree.compile(clf).save(path)
+            flat = FlatTree.load(path)
+
+        start = time.perf_counter()
+        expected = clf.predict(test_X)
+        sklearn_time = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = flat.predict(test_X)
+        flat_time = time.perf_counter() - start
+
+        assert np.array_equal(actual, expected.astype(actual.dtype)), "Predictions differ for max_leaf_nodes={}".format(
+            max_leaf_nodes
+        )
+        print(
+            "max_leaf_nodes={}: {} rows match, sklearn {:.1f} ms, flat {:.1f} ms".format(
+                max_leaf_nodes, len(test_X), 1000 * sklearn_time, 1000 * flat_time
+            )
+        )
+
+        # Rows of another width are rejected, whichever columns the tree happens to use
+        assert flat.n_features == train_X.shape[1]
+        for width in [train_X.shape[1] - 1, train_X.shape[1] + 1]:
+            try:
+                flat.predict(np.zeros((3, width)))
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("Rows of {} features were not rejected".format(width))
+
+        # Missing values are rejected, as scikit-learn 0.20 in the image does, e.g. a short record that
+        # pandas pads with NaN. Infinity is rejected too, also once a value overflows float32.
+        short_rows = pd.read_csv(io.BytesIO(b"5.1,3.5,1.4,0.2\n6,3,5,2\n6,3,5\n"), header=None).to_numpy()
+        for rows in [short_rows, np.array([[np.inf, 0, 0, 0]]), np.array([[1e39, 0, 0, 0]])]:
+            try:
+                flat.predict(rows)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("Non-finite rows {} were not rejected".format(rows.tolist()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+# Checks the streaming invocation path of the predictor against a tree trained on the data in
+# test_dir, with both scoring engines. Run it from this directory with: python test_stream_request.py
+
+from __future__ import print_function
+
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+
+import pandas as pd
+from sklearn import tree
+
+# Streaming is read when the predictor is imported, small blocks split the payload
+os.environ["MODEL_SERVER_STREAMING"] = "true"
+os.environ["MODEL_SERVER_STREAM_BLOCK_ROWS"] = "50"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "decision_trees"))
+import predictor
+
+training_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_dir/input/data/training/iris.csv")
+payload_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payload.csv")
+
+
+def invoke(client, body):
+    response = client.post("/invocations", data=body, content_type="text/csv")
+    return response.status_code, response.get_data(as_text=True)
+
+
+def main():
+    data = pd.read_csv(training_file, header=None)
+    clf = tree.DecisionTreeClassifier(random_state=0).fit(data.iloc[:, 1:].to_numpy(), data.iloc[:, 0].to_numpy())
+    tmp = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(tmp, "decision-tree-model.pkl"), "wb") as out:
+            pickle.dump(clf, out)
+        predictor.model_path = tmp
+        client = predictor.app.test_client()
+        with open(payload_file, "rb") as f:
+            payload = f.read()
+        expected = "".join(str(value) + "\n" for value in clf.predict(pd.read_csv(payload_file, header=None).to_numpy()))
+
+        for engine in ["sklearn", "flat"]:
+            predictor.scoring_engine = engine
+            predictor.ScoringService.model = None
+
+            status, body = invoke(client, payload)
+            assert (status, body) == (200, expected), (status, body[:100])
+            print("{}: streamed {} predictions matching sklearn".format(engine, len(body.splitlines())))
+
+            # A malformed first block is answered with a 400, before the response starts
+            malformed = [
+                ("wrong width", b"5.1,3.5,1.4\n" * 50),
+                ("non-numeric", b"5.1,3.5,1.4,abc\n"),
+                ("short record", b"5.1,3.5,1.4,0.2\n6,3,5\n"),
+            ]
+            for name, bad in malformed:
+                status, body = invoke(client, bad + payload)
+                assert status == 400, (name, status, body[:100])
+                print("{}: {} first block rejected with a 400: {}".format(engine, name, body.strip()))
+
+            # Quoted fields are left to pandas
+            status, body = invoke(client, b'"5.1",3.5,1.4,0.2\n' + payload)
+            assert (status, body) == (200, str(clf.predict([[5.1, 3.5, 1.4, 0.2]])[0]) + "\n" + expected), status
+            print("{}: quoted fields parsed by pandas".format(engine))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+#!/bin/sh
+
+# Runs the training container in Pipe mode: the training files are streamed into the FIFO
+# training_0, the way SageMaker does, instead of being mounted in the channel directory.
+
+image=$1
+
+work_dir=$(mktemp -d)
+mkdir -p ${work_dir}/input/config ${work_dir}/input/data ${work_dir}/model ${work_dir}/output
+cp test_dir/input/config/hyperparameters.json ${work_dir}/input/config/
+echo '{"training": {"TrainingInputMode": "Pipe", "RecordWrapperType": "None"}}' > ${work_dir}/input/config/inputdataconfig.json
+mkfifo ${work_dir}/input/data/training_0
+
+# The writer blocks until the trainer opens the FIFO
+cat test_dir/input/data/training/* > ${work_dir}/input/data/training_0 &
+
+docker run -v ${work_dir}:/opt/ml --rm ${image} train
+
+mkdir -p test_dir/model
+cp ${work_dir}/model/* test_dir/model/
+rm -rf ${work_dir}
@@ -2,23 +2,31 @@
 
 import json
 import io
+import re
 import sys
 import os
+import gc
+import math
 import signal
+import time
+import queue
+import threading
+import hashlib
+import random
+import collections
 import traceback
+import urllib.request
 import flask
 import multiprocessing
 import subprocess
-import tarfile
-import model
-import pandas as pd
+import shutil
 import numpy as np
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras.models import Sequential
-from tensorflow.keras.layers import Dense
-from tensorflow.keras.optimizers import Adam
-from sklearn import preprocessing
+from numpy_model import NumpyModel
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+# NOTE: Serving only needs the imports above. TensorFlow is imported when the Keras
+# backend loads the model, and the training module `model.py` (TensorFlow, pandas,
+# scikit-learn) only by the 'train' and 'test' entry points.
 
 # Adds the model.py path to the list
 prefix = '/opt/ml'
@@ -26,25 +34,756 @@ model_path = os.path.join(prefix, 'model')
 sys.path.insert(0,model_path)
 model_cache = {}
 
+# Serving backend: 'tensorflow' loads `model.h5` with Keras, 'numpy' evaluates the
+# weights exported to `model.npz` with plain NumPy and never imports TensorFlow,
+# 'tflite' runs the quantized `model.tflite` with the TensorFlow Lite interpreter
+backend = os.environ.get('MODEL_SERVER_BACKEND', 'tensorflow').lower()
+
+# Opt-in dynamic micro-batching of concurrent requests within a worker
+batching_enabled = os.environ.get('MODEL_SERVER_BATCHING', 'false').lower() == 'true'
+max_batch_size = int(os.environ.get('MODEL_SERVER_MAX_BATCH_SIZE', 64))
+max_batch_delay = float(os.environ.get('MODEL_SERVER_MAX_BATCH_DELAY_MS', 2)) / 1000
+# Opt-in LRU/TTL cache of predictions keyed by the input row
+cache_enabled = os.environ.get('MODEL_SERVER_CACHE', 'false').lower() == 'true'
+cache_max_bytes = int(os.environ.get('MODEL_SERVER_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+cache_ttl = float(os.environ.get('MODEL_SERVER_CACHE_TTL', 0)) # `0` keeps entries until evicted
+# Stream CSV bodies through the model block by block, e.g. for SageMaker Batch Transform
+streaming_enabled = os.environ.get('MODEL_SERVER_STREAMING', os.environ.get('SAGEMAKER_BATCH', 'false')).lower() == 'true'
+stream_block_rows = int(os.environ.get('MODEL_SERVER_STREAM_BLOCK_ROWS', 1024))
+stream_chunk_bytes = 64 * 1024
+# Seconds between micro-batching and cache statistics log lines
+stats_interval = float(os.environ.get('MODEL_SERVER_STATS_INTERVAL', 60))
+# Server mode: 'wsgi' runs the flask app on gevent workers, 'asgi' runs asgi.py on
+# uvicorn workers with inference offloaded to a bounded thread pool
+server_mode = os.environ.get('MODEL_SERVER_MODE', 'wsgi').lower()
+# Prepare the model in the gunicorn master before the workers are forked: the NumPy model
+# is loaded there and shared copy-on-write, the other backends' files are read into the
+# page cache and every worker loads and warms its own copy right after the fork
+preload_enabled = os.environ.get('MODEL_SERVER_PRELOAD', 'false').lower() == 'true'
+# Row width of raw 'application/octet-stream' bodies without a `features` parameter
+feature_count = int(os.environ.get('MODEL_SERVER_FEATURE_COUNT', 10))
+# Opt-in multi-model hosting: requests name a model with the `X-Amzn-SageMaker-Target-Model`
+# header or the `/models/<name>/invoke` path, and every model is loaded on demand from its
+# own folder under `MODEL_SERVER_MODELS_PATH` into a bounded LRU pool of each worker
+multi_model_enabled = os.environ.get('MODEL_SERVER_MULTI_MODEL', 'false').lower() == 'true'
+models_path = os.environ.get('MODEL_SERVER_MODELS_PATH', os.path.join(prefix, 'models'))
+pool_max_models = int(os.environ.get('MODEL_SERVER_POOL_MAX_MODELS', 100))
+pool_max_bytes = int(os.environ.get('MODEL_SERVER_POOL_MAX_BYTES', 1024 * 1024 * 1024))
+model_name_pattern = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+# Seconds between checks of the model folder for a new model version, `0` disables
+# hot reload. `POST /reload` touches `reload_stamp_path` to make every worker reload.
+reload_interval = float(os.environ.get('MODEL_SERVER_RELOAD_INTERVAL', 0))
+reload_stamp_path = '/tmp/model-reload'
+
+# Per-stage latency, request and payload metrics. The gunicorn workers write them to
+# `PROMETHEUS_MULTIPROC_DIR` and `/metrics` aggregates them across workers.
+metrics_path = '/tmp/prometheus'
+latency_buckets = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+stage_latency = Histogram('inference_stage_latency_seconds', 'Latency of each invocation stage', ['stage'], buckets=latency_buckets)
+request_count = Counter('inference_requests_total', 'Invocation requests by status code', ['status'])
+row_count = Counter('inference_rows_total', 'Records scored by invocation requests')
+payload_size = Histogram('inference_payload_bytes', 'Size of invocation payloads', ['direction'],
+                         buckets=tuple(4 ** power for power in range(3, 14)))
+in_flight_requests = Gauge('inference_in_flight_requests', 'Invocation requests being processed', multiprocess_mode='livesum')
+pool_latency = Histogram('model_pool_latency_seconds', 'Latency of model pool loads and evictions', ['operation'],
+                         buckets=latency_buckets + (30, 60))
+pool_models = Gauge('model_pool_models', 'Models held by the model pools', multiprocess_mode='livesum')
+pool_bytes = Gauge('model_pool_bytes', 'Size of the model files held by the model pools', multiprocess_mode='livesum')
+
+reload_latency = Histogram('model_reload_seconds', 'Latency of loading and warming a reloaded model',
+                           buckets=latency_buckets + (30, 60))
+reload_count = Counter('model_reloads_total', 'Model hot reloads by outcome', ['status'])
+
+class ModelNotFoundError(LookupError):
+    pass
+
+class PredictionCache(object):
+    """
+    Description:
+    -----------
+    Bounded in-worker cache of predictions keyed by a hash of the normalized input
+    row. Entries are evicted least recently used first once `max_bytes` is reached,
+    and expire after `ttl` seconds when `ttl` is positive. Hits and misses are counted
+    per row. The entries of a named model are dropped with `clear_namespace()` when
+    the model pool loads or evicts it.
+
+    :max_bytes: (int) Approximate memory cap of the cached entries.
+    :ttl: (float) Seconds an entry stays valid, `0` for no expiry.
+    """
+    # Approximate bookkeeping cost of an entry on top of its key and result
+    entry_overhead = 200
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.last_report = time.monotonic()
+        # Bumped by `clear()`, and per model name by `clear_namespace()`, so predictions
+        # of the previous model are not stored back
+        self.generation = 0
+        self.generations = collections.defaultdict(int)
+        # Guards the entries when the ASGI mode scores on several threads
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def keys(data, namespace=None):
+        # Same values hash the same regardless of the request dtype or signed zeros
+        rows = np.ascontiguousarray(data, dtype=np.float32) + np.float32(0)
+        # Rows scored by different models of the pool never share an entry
+        prefix = hashlib.blake2b(namespace.encode('utf-8'), digest_size=16).digest() if namespace else b''
+        return [hashlib.blake2b(prefix + row.tobytes(), digest_size=16).digest() for row in rows]
+
+    def get(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires, result, _ = entry
+        if self.ttl > 0 and expires < now:
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result, now, namespace=None):
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = (now + self.ttl, result, namespace)
+        self.size += len(key) + result.nbytes + self.entry_overhead
+        while self.size > self.max_bytes and self.entries:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key):
+        _, result, _ = self.entries.pop(key)
+        self.size -= len(key) + result.nbytes + self.entry_overhead
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.generation += 1
+
+    def clear_namespace(self, namespace):
+        # Drops the predictions of one named model, e.g. before its artifacts are reloaded
+        with self.lock:
+            for key in [key for key, (_, _, name) in self.entries.items() if name == namespace]:
+                self.remove(key)
+            self.generations[namespace] += 1
+
+    def predict(self, data, predict_fn, namespace=None):
+        """
+        Description:
+        -----------
+        Looks up every row and sends only the rows that miss to the model, filling
+        the cache row by row.
+
+        :data: (NumPy Array) Observations of shape (records, features).
+        :predict_fn: (function) Scores the rows that are not cached.
+        :namespace: (str) Name of the model in multi-model mode.
+
+        :returns: (NumPy Array) Predictions in input order.
+        """
+        if len(data) == 0:
+            return predict_fn(data)
+        now = time.monotonic()
+        keys = self.keys(data, namespace)
+        missing = collections.OrderedDict()
+        with self.lock:
+            generation = (self.generation, self.generations[namespace])
+            results = [self.get(key, now) for key in keys]
+            for index, result in enumerate(results):
+                if result is None:
+                    missing.setdefault(keys[index], []).append(index)
+            misses = sum(len(indices) for indices in missing.values())
+            self.hits += len(results) - misses
+            self.misses += misses
+        if missing:
+            # Duplicate rows within the request are scored once
+            predictions = predict_fn(data[[indices[0] for indices in missing.values()]])
+            with self.lock:
+                for (key, indices), result in zip(missing.items(), predictions):
+                    # The model was swapped while scoring, the result still answers this request
+                    if generation == (self.generation, self.generations[namespace]):
+                        self.put(key, result, now, namespace)
+                    for index in indices:
+                        results[index] = result
+        if now - self.last_report >= stats_interval:
+            self.last_report = now
+            print("Prediction cache stats: {}".format(json.dumps(self.stats())))
+        return np.stack(results)
+
+    def stats(self):
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+class ModelPool(object):
+    """
+    Description:
+    -----------
+    Models loaded on demand from their folder under `root` and held least recently
+    used first, within `max_models` models and `max_bytes` of model files. The load
+    and eviction latencies are recorded in `model_pool_latency_seconds`.
+
+    :root: (str) Folder with one sub-folder of model artifacts per model name.
+    :loader: (function) Loads the model in a folder.
+    :max_models: (int) Maximum number of models held.
+    :max_bytes: (int) Maximum size of the model files held, approximates memory.
+    :forget_fn: (function) Called with the name of every model loaded or evicted, e.g.
+        to drop its cached predictions.
+    """
+    def __init__(self, root, loader, max_models, max_bytes, forget_fn=None):
+        self.root = root
+        self.loader = loader
+        self.forget_fn = forget_fn
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.models = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        # One lock per model being loaded, so concurrent requests load it once
+        self.loading = {}
+
+    def path(self, name):
+        if not model_name_pattern.match(name):
+            raise ValueError("Invalid model name '{}'.".format(name))
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(path):
+            raise ModelNotFoundError("Model '{}' not found.".format(name))
+        return path
+
+    def lookup(self, name):
+        entry = self.models.get(name)
+        if entry is None:
+            return None
+        self.models.move_to_end(name)
+        self.hits += 1
+        return entry[0]
+
+    def get(self, name):
+        with self.lock:
+            model = self.lookup(name)
+            if model is not None:
+                return model
+        # Invalid and unknown names fail here, before they take a loading entry
+        path = self.path(name)
+        with self.lock:
+            loading = self.loading.setdefault(name, threading.Lock())
+        try:
+            with loading:
+                with self.lock:
+                    model = self.lookup(name)
+                    if model is not None:
+                        return model
+                with pool_latency.labels('load').time():
+                    started = time.perf_counter()
+                    model = self.loader(path)
+                    elapsed = time.perf_counter() - started
+                size = directory_size(path)
+                # The artifacts may have changed since the model was last held
+                self.forget(name)
+                with self.lock:
+                    self.models[name] = (model, size)
+                    self.size += size
+                    self.loads += 1
+                    pool_models.inc()
+                    pool_bytes.inc(size)
+                    evicted = self.evict()
+        finally:
+            # Also after a failed load, so that the entry never outlives its load
+            with self.lock:
+                if self.loading.get(name) is loading:
+                    del self.loading[name]
+        self.release(evicted)
+        print("Loaded model '{}' ({:.1f}MB) in {:.1f} ms. Model pool stats: {}".format(
+            name, size / (1024 * 1024), 1000 * elapsed, json.dumps(self.stats())))
+        return model
+
+    def evict(self):
+        # Called with the lock held. The model just loaded is always kept. The evicted
+        # models are returned to be freed by `release()` once the lock is released.
+        evicted = []
+        while len(self.models) > 1 and (len(self.models) > self.max_models or self.size > self.max_bytes):
+            name, (model, size) = self.models.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            pool_models.dec()
+            pool_bytes.dec(size)
+            evicted.append((name, model, size))
+        return evicted
+
+    def forget(self, name):
+        if self.forget_fn is not None:
+            self.forget_fn(name)
+
+    def release(self, evicted):
+        # Free the evicted models without holding the lock, so that requests for the
+        # models still held do not wait on the garbage collector
+        if not evicted:
+            return
+        for name, _, _ in evicted:
+            self.forget(name)
+        with pool_latency.labels('evict').time():
+            started = time.perf_counter()
+            names = [(name, size) for name, _, size in evicted]
+            del evicted[:]
+            if backend == 'tensorflow':
+                # Keras models hold reference cycles that only the collector frees
+                gc.collect()
+            elapsed = time.perf_counter() - started
+        for name, size in names:
+            print("Evicted model '{}' ({:.1f}MB) in {:.1f} ms.".format(name, size / (1024 * 1024), 1000 * elapsed))
+
+    def stats(self):
+        return {
+            'models': len(self.models),
+            'bytes': self.size,
+            'hits': self.hits,
+            'loads': self.loads,
+            'evictions': self.evictions
+        }
+
+def model_signature(path):
+    # Name, modification time and size of every model file, plus the reload stamp
+    signature = []
+    for root, _, files in os.walk(path):
+        for file in sorted(files):
+            stat = os.stat(os.path.join(root, file))
+            signature.append((os.path.join(root, file), stat.st_mtime_ns, stat.st_size))
+    if os.path.exists(reload_stamp_path):
+        signature.append((reload_stamp_path, os.stat(reload_stamp_path).st_mtime_ns, 0))
+    return signature
+
+class ModelReloader(object):
+    """
+    Description:
+    -----------
+    Polls the model folder of a worker about every `interval` seconds, jittered so the
+    workers do not all reload at the same moment. Once the model files changed and
+    stayed the same for one more poll, so a copy in progress is not read, the new model
+    is loaded and warmed off the serving loop and handed to `swap_fn`. Requests already
+    running keep the model they started with, which is freed once they finish.
+
+    :path: (str) Model folder to watch.
+    :interval: (float) Seconds between polls.
+    :swap_fn: (function) Installs the new model.
+    """
+    def __init__(self, path, interval, swap_fn):
+        self.path = path
+        self.interval = interval
+        self.swap_fn = swap_fn
+        self.pid = os.getpid()
+        self.loaded = model_signature(path)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        pending = None
+        while True:
+            time.sleep(self.interval * random.uniform(0.75, 1.25))
+            try:
+                current = model_signature(self.path)
+            except OSError:
+                # Files replaced while listing them
+                continue
+            if current == self.loaded or current != pending:
+                pending = None if current == self.loaded else current
+                continue
+            self.reload(current)
+            pending = None
+
+    @staticmethod
+    def load_warm():
+        model = load_model()
+        warm_model(model)
+        return model
+
+    def load(self):
+        # Under gevent the watcher thread is a greenlet, so a load on it would block every
+        # request of the worker: hand it to the hub's pool of real threads instead
+        if 'gevent.monkey' in sys.modules and sys.modules['gevent.monkey'].is_module_patched('threading'):
+            import gevent
+            return gevent.get_hub().threadpool.apply(self.load_warm)
+        return self.load_warm()
+
+    def reload(self, signature):
+        started = time.perf_counter()
+        try:
+            with reload_latency.time():
+                model = self.load()
+        except Exception:
+            # Keep serving the current model until the files change again
+            reload_count.labels('failure').inc()
+            print('Model reload failed, keeping the current model:\n' + traceback.format_exc())
+        else:
+            self.swap_fn(model)
+            reload_count.labels('success').inc()
+            print('Model reloaded and warmed in {:.2f} seconds.'.format(time.perf_counter() - started))
+        self.loaded = signature
+
 class PredictionService(object):
     tf_model = None
+    batcher = None
+    cache = PredictionCache(cache_max_bytes, cache_ttl) if cache_enabled else None
+    pool = None
+    reloader = None
     @classmethod
-    def get_model(cls):
+    def get_model(cls, model_name=None):
+        if model_name is not None:
+            if cls.pool is None:
+                cls.pool = ModelPool(models_path, load_model, pool_max_models, pool_max_bytes,
+                                     cls.cache.clear_namespace if cls.cache is not None else None)
+            return cls.pool.get(model_name)
         if cls.tf_model is None:
-            cls.tf_model = load_model()
+            cls.swap(load_model())
+        if reload_interval > 0 and (cls.reloader is None or cls.reloader.pid != os.getpid()):
+            # Started in the serving worker, threads do not survive the fork of a preloading master
+            cls.reloader = ModelReloader(model_path, reload_interval, cls.swap)
         return cls.tf_model
 
     @classmethod
-    def predict(cls, input):
+    def swap(cls, model):
+        # A single reference assignment, so every request sees either the old or the new model
+        cls.tf_model = model
+        if cls.cache is not None:
+            # Cached predictions belong to the previous model
+            cls.cache.clear()
+
+    @classmethod
+    def predict(cls, input, model_name=None):
+        # Named models are scored directly, since the micro-batcher merges requests for one model
+        predict_fn = cls.predict_uncached if model_name is None else cls.get_model(model_name).predict
+        if cls.cache is not None:
+            return cls.cache.predict(input, predict_fn, model_name)
+        return predict_fn(input)
+
+    @classmethod
+    def predict_uncached(cls, input):
+        if batching_enabled:
+            if cls.batcher is None:
+                cls.batcher = MicroBatcher(cls.predict_batch, max_batch_size, max_batch_delay)
+            return cls.batcher.predict(input)
+        return cls.predict_batch(input)
+
+    @classmethod
+    def predict_batch(cls, input):
         tf_model = cls.get_model()
         return tf_model.predict(input)
 
-def load_model():
-    # Load 'h5' keras model
-    model = tf.keras.models.load_model(os.path.join(model_path, 'model.h5'))
+class PendingRequest(object):
+    def __init__(self, data):
+        self.data = data
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class MicroBatcher(object):
+    """
+    Description:
+    -----------
+    Queues concurrent requests within a worker and merges them into a single
+    forward pass of up to `max_batch_size` rows, waiting at most `max_delay`
+    seconds for the batch to fill. Only requests of the same row width are merged,
+    and a single request larger than `max_batch_size` is scored on its own.
+    Results are scattered back to the callers.
+
+    :predict_fn: (function) Scores a 2-D NumPy array in one call.
+    :max_batch_size: (int) Maximum number of rows per forward pass.
+    :max_delay: (float) Maximum seconds to hold the first request of a batch.
+    """
+    def __init__(self, predict_fn, max_batch_size, max_delay):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.worker = None
+        # Counters used to tune throughput against tail latency
+        self.batch_sizes = collections.Counter()
+        self.queue_wait_count = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.last_report = time.perf_counter()
+
+    def predict(self, data):
+        if self.worker is None:
+            # Started lazily so that the thread lives in the serving worker
+            self.worker = threading.Thread(target=self.run, daemon=True)
+            self.worker.start()
+        request = PendingRequest(data)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def run(self):
+        carry = None
+        while True:
+            batch = [carry if carry is not None else self.requests.get()]
+            carry = None
+            rows = batch[0].data.shape[0]
+            width = batch[0].data.shape[1:]
+            deadline = time.perf_counter() + self.max_delay
+            while rows < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if rows + request.data.shape[0] > self.max_batch_size or request.data.shape[1:] != width:
+                    # Starts the next batch: a batch never exceeds `max_batch_size` rows, and
+                    # a request of another width cannot fail the requests it would be merged with
+                    carry = request
+                    break
+                batch.append(request)
+                rows += request.data.shape[0]
+            self.score(batch, rows)
+
+    def score(self, batch, rows):
+        started = time.perf_counter()
+        for request in batch:
+            wait = started - request.enqueued
+            self.queue_wait_count += 1
+            self.queue_wait_total += wait
+            self.queue_wait_max = max(self.queue_wait_max, wait)
+        self.batch_sizes[rows] += 1
+        try:
+            predictions = self.predict_fn(np.concatenate([request.data for request in batch]))
+            offsets = np.cumsum([request.data.shape[0] for request in batch])[:-1]
+            for request, result in zip(batch, np.split(predictions, offsets)):
+                request.result = result
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        for request in batch:
+            request.done.set()
+        if started - self.last_report >= stats_interval:
+            self.last_report = started
+            print("Micro-batching stats: {}".format(json.dumps(self.stats())))
+
+    def stats(self):
+        return {
+            'batch_sizes': {str(size): count for size, count in sorted(self.batch_sizes.items())},
+            'queue_wait_count': self.queue_wait_count,
+            'queue_wait_mean_ms': 1000 * self.queue_wait_total / max(self.queue_wait_count, 1),
+            'queue_wait_max_ms': 1000 * self.queue_wait_max
+        }
+
+def load_model(path=None):
+    path = model_path if path is None else path
+    if backend == 'numpy':
+        return NumpyModel.load(os.path.join(path, 'model.npz'))
+    if backend == 'tflite':
+        # Imported here, `tflite_runtime` or TensorFlow is only needed by this backend
+        from tflite_model import TFLiteModel
+        threads = os.environ.get('TF_NUM_INTRAOP_THREADS')
+        return TFLiteModel.load(os.path.join(path, 'model.tflite'), int(threads) if threads else None)
+    # Load 'h5' keras model, importing TensorFlow only for this backend
+    import tensorflow as tf
+    model = tf.keras.models.load_model(os.path.join(path, 'model.h5'))
     model.compile(optimizer='adam', loss='mse')
     return model
 
+def warm_model(model):
+    # Runs the first prediction, which builds the TensorFlow graph, outside of a request
+    model.predict(np.zeros((1, feature_count), dtype=np.float32))
+
+def preload_model():
+    # Runs once in the gunicorn master before the workers are forked
+    started = time.perf_counter()
+    if backend == 'numpy':
+        model = load_model()
+        warm_model(model)
+        PredictionService.swap(model)
+        print("Model preloaded and warmed in {:.2f} seconds.".format(time.perf_counter() - started))
+        return
+    # TensorFlow and TensorFlow Lite start thread pools that do not survive a fork, and
+    # the workers deadlock in them. The master only reads the model files, so loading
+    # them in the workers does not wait on the disk.
+    size = 0
+    for root, _, files in os.walk(model_path):
+        for file in files:
+            with open(os.path.join(root, file), 'rb') as f:
+                while True:
+                    chunk = f.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+    print("Model files preloaded ({:.1f}MB) in {:.2f} seconds.".format(size / (1024 * 1024), time.perf_counter() - started))
+
+def warm_worker():
+    # Called by the `post_fork` hook in every worker: loads and warms the model the
+    # master left to the workers, before the worker accepts requests
+    if PredictionService.tf_model is None:
+        started = time.perf_counter()
+        warm_model(PredictionService.get_model())
+        print("Worker {} loaded and warmed the model in {:.2f} seconds.".format(os.getpid(), time.perf_counter() - started))
+
+def csv_to_numpy(body, params=None):
+    """
+    Description:
+    -----------
+    Parses a newline-delimited CSV request body into a 2-D NumPy array.
+
+    :body: (Bytes) Request body with one observation per line.
+    :params: (dict) Content type parameters, unused.
+
+    :returns: (NumPy Array) Array of shape (records, features).
+    """
+    rows = [row.rstrip() for row in body.decode('utf-8').splitlines() if row.strip()]
+    if len(rows) == 0:
+        raise ValueError("Request body contains no records.")
+    # A trailing comma ends a record, it does not start an empty feature
+    rows = [row[:-1] if row.endswith(',') else row for row in rows]
+    # Ragged records would otherwise shift features across rows in the reshape below
+    widths = set(row.count(',') + 1 for row in rows)
+    if len(widths) != 1:
+        raise ValueError("Every record must contain the same number of features, found {}.".format(sorted(widths)))
+    width = widths.pop()
+    # Parse every record in one pass instead of row by row
+    try:
+        payload = np.fromstring(','.join(rows), sep=',')
+    except ValueError:
+        # Newer NumPy raises on text it cannot parse, older versions stop reading early
+        payload = None
+    if payload is None or payload.size != len(rows) * width:
+        raise ValueError("Every feature must be a number, found empty or non-numeric values.")
+    return payload.reshape(len(rows), width)
+
+def model_features(model):
+    # Row width of a model: the NumPy and TFLite models record it, Keras models have an input shape
+    features = getattr(model, 'features', None)
+    return int(features if features is not None else model.input_shape[-1])
+
+def check_features(data, model_name=None):
+    # Records of another width than the model's are the client's error, not the model's
+    expected = model_features(PredictionService.get_model(model_name))
+    if data.shape[1] != expected:
+        raise ValueError("Every record must contain {} features, found {}.".format(expected, data.shape[1]))
+    return data
+
+def csv_blocks(stream, block_rows, chunk_bytes=stream_chunk_bytes):
+    """
+    Description:
+    -----------
+    Reads a CSV request body in chunks and yields it as blocks of complete records,
+    so that memory stays flat regardless of the payload size.
+
+    :stream: (File) Readable request body stream.
+    :block_rows: (int) Number of records per block.
+    :chunk_bytes: (int) Number of bytes read from the stream at a time.
+
+    :returns: (Generator) Bytes blocks of at most `block_rows` records.
+    """
+    remainder = b''
+    rows = []
+    while True:
+        chunk = stream.read(chunk_bytes)
+        if not chunk:
+            break
+        lines = (remainder + chunk).split(b'\n')
+        # The last line may continue in the next chunk
+        remainder = lines.pop()
+        rows.extend(line for line in lines if line.strip())
+        while len(rows) >= block_rows:
+            yield b'\n'.join(rows[:block_rows])
+            rows = rows[block_rows:]
+    if remainder.strip():
+        rows.append(remainder)
+    if rows:
+        yield b'\n'.join(rows)
+
+class CountingReader(object):
+    # Counts the bytes read from a request body stream, for the payload size metric
+    def __init__(self, stream):
+        self.stream = stream
+        self.size = 0
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.size += len(chunk)
+        return chunk
+
+def npy_to_numpy(body, params=None):
+    """
+    Description:
+    -----------
+    Wraps an `.npy` request body as a NumPy array without copying the data.
+
+    :body: (Bytes) Request body in NumPy `.npy` format.
+    :params: (dict) Content type parameters, unused.
+
+    :returns: (NumPy Array) Array of shape (records, features).
+    """
+    header = io.BytesIO(body)
+    version = np.lib.format.read_magic(header)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(header)
+    elif version == (2, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(header)
+    else:
+        raise ValueError("Unsupported .npy format version {}.".format(version))
+    # Booleans, integers and floats of shape (records, features) with at least one record
+    if dtype.kind not in 'biuf' or len(shape) != 2 or shape[0] == 0:
+        raise ValueError("Request body must be a 2-D numeric array with at least one record.")
+    payload = np.frombuffer(body, dtype=dtype, count=int(np.prod(shape)), offset=header.tell())
+    return payload.reshape(shape, order='F' if fortran_order else 'C')
+
+def octet_stream_to_numpy(body, params=None):
+    """
+    Description:
+    -----------
+    Wraps a raw little-endian float32 request body as a NumPy array without copying
+    the data. The row width is read from the `features` content type parameter,
+    e.g. 'application/octet-stream; features=10', or `MODEL_SERVER_FEATURE_COUNT`.
+
+    :body: (Bytes) Request body of packed little-endian float32 values.
+    :params: (dict) Content type parameters.
+
+    :returns: (NumPy Array) Array of shape (records, features).
+    """
+    width = int((params or {}).get('features', feature_count))
+    if width <= 0 or len(body) == 0 or len(body) % (4 * width) != 0:
+        raise ValueError("Request body must contain records of {} float32 features.".format(width))
+    return np.frombuffer(body, dtype='<f4').reshape(-1, width)
+
+def numpy_to_csv(predictions):
+    # One result per line in input order
+    return ''.join(str(value) + '\n' for value in predictions.flatten())
+
+def numpy_to_npy(predictions):
+    out = io.BytesIO()
+    np.save(out, predictions.astype('<f4'))
+    return out.getvalue()
+
+def numpy_to_octet_stream(predictions):
+    return predictions.astype('<f4').tobytes()
+
+# Request decoders and response encoders by content type. Responses are returned
+# in the same format as the request so binary clients skip text encoding both ways.
+content_types = {
+    'text/csv': (csv_to_numpy, numpy_to_csv),
+    'application/x-npy': (npy_to_numpy, numpy_to_npy),
+    'application/octet-stream': (octet_stream_to_numpy, numpy_to_octet_stream)
+}
+
 def sigterm_handler(nginx_pid, gunicorn_pid):
     try:
         os.kill(nginx_pid, signal.SIGQUIT)
@@ -57,19 +796,133 @@ def sigterm_handler(nginx_pid, gunicorn_pid):
 
     sys.exit(0)
 
+def worker_pids(gunicorn_pid):
+    # Gunicorn workers are the direct children of the master process
+    pids = []
+    for pid in os.listdir('/proc'):
+        if not pid.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(pid)) as stat:
+                ppid = int(stat.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        if ppid == gunicorn_pid:
+            pids.append(int(pid))
+    return sorted(pids)
+
+def memory_usage(pid):
+    # Resident (RSS) and proportional (PSS) set size in MB. PSS splits the shared
+    # copy-on-write pages between the workers, so it shows the savings of preloading.
+    usage = {}
+    with open('/proc/{}/smaps_rollup'.format(pid)) as smaps:
+        for line in smaps:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                usage[key.lower()] = int(value.split()[0]) / 1024
+    return usage
+
+def report_startup(started, gunicorn_pid, timeout=600):
+    # Wait for the first healthy `/ping` through nginx, then report memory per worker
+    while time.perf_counter() - started < timeout:
+        try:
+            if urllib.request.urlopen('http://localhost:8080/ping').getcode() == 200:
+                break
+        except Exception:
+            time.sleep(0.1)
+    else:
+        print('Inference server not healthy after {} seconds.'.format(timeout))
+        return
+    print('Inference server healthy in {:.2f} seconds (preload: {}).'.format(time.perf_counter() - started, preload_enabled))
+    processes = [('master', gunicorn_pid)] + [('worker', pid) for pid in worker_pids(gunicorn_pid)]
+    for role, pid in processes:
+        try:
+            usage = memory_usage(pid)
+        except OSError:
+            continue
+        print('Gunicorn {} {}: rss={:.1f}MB pss={:.1f}MB'.format(role, pid, usage.get('rss', 0), usage.get('pss', 0)))
+
+def cpu_limit():
+    # CPUs the container may use: the cgroup CPU quota rounded up, capped by the CPU
+    # affinity mask. `multiprocessing.cpu_count()` reports every core of the host.
+    cpus = len(os.sched_getaffinity(0))
+    quota = None
+    try:
+        # cgroup v2, e.g. '200000 100000' or 'max 100000'
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            limit, period = f.read().split()
+        if limit != 'max':
+            quota = int(limit) / int(period)
+    except (OSError, ValueError):
+        # cgroup v1, a quota of -1 is unlimited
+        for folder in ['/sys/fs/cgroup/cpu', '/sys/fs/cgroup/cpu,cpuacct']:
+            try:
+                with open(os.path.join(folder, 'cpu.cfs_quota_us')) as f:
+                    limit = int(f.read())
+                with open(os.path.join(folder, 'cpu.cfs_period_us')) as f:
+                    period = int(f.read())
+            except (OSError, ValueError):
+                continue
+            if limit > 0:
+                quota = limit / period
+            break
+    if quota is not None:
+        cpus = min(cpus, max(1, math.ceil(quota)))
+    return cpus
+
+def size_server(cpus):
+    """
+    Description:
+    -----------
+    Sizes the gunicorn workers and the thread pools of every worker together, so that
+    workers x threads matches the CPUs of the container instead of each worker's
+    TensorFlow, OpenMP and BLAS pools claiming every core of the host. Explicit
+    `MODEL_SERVER_WORKERS`, `MODEL_SERVER_THREADS_PER_WORKER` or thread pool
+    variables take precedence.
+
+    :cpus: (int) CPUs available to the container.
+
+    :returns: (int) Number of gunicorn workers.
+    """
+    if 'MODEL_SERVER_THREADS_PER_WORKER' in os.environ:
+        threads = int(os.environ['MODEL_SERVER_THREADS_PER_WORKER'])
+        workers = int(os.environ.get('MODEL_SERVER_WORKERS', max(1, cpus // threads)))
+    else:
+        workers = int(os.environ.get('MODEL_SERVER_WORKERS', cpus))
+        threads = max(1, cpus // workers)
+    # Inherited by the workers, and read by `gunicorn_config.py` for CPU affinity
+    os.environ['MODEL_SERVER_THREADS_PER_WORKER'] = str(threads)
+    for variable in ['OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS']:
+        os.environ.setdefault(variable, str(threads))
+    # Requests are parallelized across workers, not across the ops of one small graph
+    os.environ.setdefault('TF_NUM_INTEROP_THREADS', '1')
+    print('Sized for {} CPUs (host has {}): {} workers with {} threads each.'.format(
+        cpus, multiprocessing.cpu_count(), workers, threads))
+    return workers
+
 def start_server(timeout, workers):
-    print('Starting the inference server with {} workers.'.format(model_server_workers))
+    print('Starting the {} inference server with {} workers.'.format(server_mode, workers))
+    started = time.perf_counter()
     # link the log streams to stdout/err so they will be logged to the container logs
     subprocess.check_call(['ln', '-sf', '/dev/stdout', '/var/log/nginx/access.log'])
     subprocess.check_call(['ln', '-sf', '/dev/stderr', '/var/log/nginx/error.log'])
 
+    # Start every run with empty metrics shared by the gunicorn workers
+    shutil.rmtree(metrics_path, ignore_errors=True)
+    os.makedirs(metrics_path)
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = metrics_path
+
     nginx = subprocess.Popen(['nginx', '-c', '/opt/program/nginx.conf'])
     gunicorn = subprocess.Popen(['gunicorn',
+                                 '-c', '/opt/program/gunicorn_config.py',
                                  '--timeout', str(timeout),
-                                 '-k', 'gevent',
+                                 '-k', 'uvicorn.workers.UvicornWorker' if server_mode == 'asgi' else 'gevent',
                                  '-b', 'unix:/tmp/gunicorn.sock',
-                                 '-w', str(workers),
-                                 'wsgi:app'])
+                                 '-w', str(workers)] +
+                                (['--preload'] if preload_enabled else []) +
+                                ['asgi:app' if server_mode == 'asgi' else 'wsgi:app'])
+
+    threading.Thread(target=report_startup, args=(started, gunicorn.pid), daemon=True).start()
 
     signal.signal(signal.SIGTERM, lambda a, b: sigterm_handler(nginx.pid, gunicorn.pid))
 
@@ -88,41 +941,155 @@ app = flask.Flask(__name__)
 
 @app.route('/ping', methods=['GET'])
 def ping():
-    health = PredictionService.get_model() is not None
+    if multi_model_enabled:
+        # Models are loaded by the requests that name them
+        health = os.path.isdir(models_path)
+    else:
+        health = PredictionService.get_model() is not None
     status = 200 if health else 404
     return flask.Response(response='\n', status=status, mimetype='application/json')
 
+@app.route('/reload', methods=['POST'])
+def reload():
+    # Every worker reloads the model at its next poll of the model folder
+    if reload_interval <= 0:
+        return flask.Response(response='Hot reload is not enabled, set MODEL_SERVER_RELOAD_INTERVAL.', status=400, mimetype='text/plain')
+    with open(reload_stamp_path, 'a'):
+        os.utime(reload_stamp_path)
+    return flask.Response(response='\n', status=202, mimetype='application/json')
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    registry = CollectorRegistry()
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        # Single process outside of `start_server()`
+        from prometheus_client import REGISTRY as registry
+    return flask.Response(response=generate_latest(registry), status=200, mimetype=CONTENT_TYPE_LATEST)
+
+def target_model(name):
+    """
+    Description:
+    -----------
+    Resolves the model named by a request in multi-model mode.
+
+    :name: (str) Value of the `X-Amzn-SageMaker-Target-Model` header or of the path.
+
+    :returns: (str) Model name, or None to score with the single model.
+    """
+    if not name:
+        return None
+    if not multi_model_enabled:
+        raise ModelNotFoundError("Multi-model mode is not enabled, set MODEL_SERVER_MULTI_MODEL=true.")
+    # SageMaker multi-model endpoints name the model by its artifact, e.g. 'abalone-a.tar.gz'
+    return name[:-len('.tar.gz')] if name.endswith('.tar.gz') else name
+
 @app.route('/invocations', methods=['POST'])
-def invoke():
+@app.route('/models/<model_name>/invoke', methods=['POST'])
+def invoke(model_name=None):
+    with in_flight_requests.track_inprogress():
+        try:
+            response = invocation(model_name or flask.request.headers.get('X-Amzn-SageMaker-Target-Model'))
+        except Exception:
+            request_count.labels(500).inc()
+            raise
+    request_count.labels(response.status_code).inc()
+    return response
+
+def invocation(model_name=None):
     data = None
-    if flask.request.content_type == 'text/csv':
+    content_type = flask.request.mimetype
+    try:
+        # Load a named model before reading the body, so a missing model is a 404
+        model_name = target_model(model_name)
+        if model_name is not None:
+            PredictionService.get_model(model_name)
+    except ValueError as e:
+        return flask.Response(response=str(e), status=400, mimetype='text/plain')
+    except ModelNotFoundError as e:
+        return flask.Response(response=str(e), status=404, mimetype='text/plain')
+    if streaming_enabled and content_type == 'text/csv':
+        return stream_invocation(model_name)
+    if content_type in content_types:
         """
         NOTE: print(flask.request.data) --> Bytes string
         """
-        payload = np.fromstring(flask.request.data.decode('utf-8'), sep=',') # Convert `str` to `Numpy`
-        data = payload.reshape(1, -1) # Vectorize the payload
+        decoder, encoder = content_types[content_type]
+        with stage_latency.labels('read').time():
+            body = flask.request.get_data()
+        payload_size.labels('request').observe(len(body))
+        try:
+            with stage_latency.labels('parse').time():
+                data = check_features(decoder(body, flask.request.mimetype_params), model_name) # One row per record
+        except ValueError as e:
+            return flask.Response(response=str(e), status=400, mimetype='text/plain')
     else:
-        return flask.Response(response="Invalid request data type, only 'text/csv' is supported.", status=415, mimetype='text/plain')
-    
-    # Get predictions
-    predictions = PredictionService.predict(data)
-
-    # Convert from Numpy to CSV
-    out = io.StringIO()
-    pd.DataFrame({'results':predictions.flatten()}).to_csv(out, header=False, index=False)
-    result = out.getvalue()
-    print("Prediction Result: {}".format(result))
-    return flask.Response(response=result, status=200, mimetype='text/csv')
+        return flask.Response(response="Invalid request data type, supported types are: {}.".format(', '.join(content_types)), status=415, mimetype='text/plain')
+
+    row_count.inc(data.shape[0])
+
+    # Get predictions for every record in a single batch
+    with stage_latency.labels('predict').time():
+        predictions = PredictionService.predict(data, model_name)
+
+    # Encode the predictions in the request format
+    with stage_latency.labels('serialize').time():
+        result = encoder(predictions)
+    payload_size.labels('response').observe(len(result))
+    return flask.Response(response=result, status=200, mimetype=content_type)
     
- 
+
+def stream_invocation(model_name=None):
+    # Score the body block by block as it is read and stream the results back with
+    # chunked transfer encoding. Only the first block can still be answered with a 400.
+    body = CountingReader(flask.request.stream)
+    blocks = csv_blocks(body, stream_block_rows)
+
+    def next_block(default):
+        with stage_latency.labels('read').time():
+            return next(blocks, default)
+
+    try:
+        block = next_block(b'')
+        with stage_latency.labels('parse').time():
+            data = check_features(csv_to_numpy(block), model_name)
+    except ValueError as e:
+        return flask.Response(response=str(e), status=400, mimetype='text/plain')
+
+    def generate(data):
+        response_size = 0
+        while data is not None:
+            row_count.inc(data.shape[0])
+            with stage_latency.labels('predict').time():
+                predictions = PredictionService.predict(data, model_name)
+            with stage_latency.labels('serialize').time():
+                result = numpy_to_csv(predictions)
+            response_size += len(result)
+            yield result
+            block = next_block(None)
+            with stage_latency.labels('parse').time():
+                data = None if block is None else check_features(csv_to_numpy(block), model_name)
+        payload_size.labels('request').observe(body.size)
+        payload_size.labels('response').observe(response_size)
+
+    return flask.Response(flask.stream_with_context(generate(data)), status=200, mimetype='text/csv')
+
+if preload_enabled and not multi_model_enabled and __name__ != '__main__':
+    # Imported by gunicorn with `--preload`
+    preload_model()
+
 if __name__ == '__main__':
-    print("Tensorflow Version: {}".format(tf.__version__))
     if len(sys.argv) < 2 or ( not sys.argv[1] in [ "serve", "train", "test"] ):
         raise Exception("Invalid argument: you must specify 'train' for training mode, 'serve' for predicting mode or 'test' for local testing.") 
 
     train = sys.argv[1] == "train"
     test = sys.argv[1] == "test"
 
+    if train or test:
+        import model
+        print("Tensorflow Version: {}".format(model.tf.__version__))
+
     if train:
         model.train()
         
@@ -134,7 +1101,6 @@ if __name__ == '__main__':
         print(model.predict(req, model_cache[algo]))
 
     else:
-        cpu_count = multiprocessing.cpu_count()
         model_server_timeout = os.environ.get('MODEL_SERVER_TIMEOUT', 60)
-        model_server_workers = int(os.environ.get('MODEL_SERVER_WORKERS', cpu_count))
+        model_server_workers = size_server(cpu_limit())
         start_server(model_server_timeout, model_server_workers)
\ No newline at end of file
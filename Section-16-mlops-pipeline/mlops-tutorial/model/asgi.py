@@ -0,0 +1,134 @@
+# ASGI front end for the same `/ping`, `/invocations` and `/metrics` contract as the
+# flask app in app.py. Request I/O runs on the asyncio event loop, while decoding,
+# inference and encoding run on a bounded thread pool, where TensorFlow and NumPy
+# release the GIL. Started by `app.py serve` when MODEL_SERVER_MODE=asgi.
+
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import app as service
+
+# Number of inference threads per worker
+inference_threads = int(os.environ.get('MODEL_SERVER_INFERENCE_THREADS', 2))
+executor = ThreadPoolExecutor(max_workers=inference_threads)
+
+
+def parse_content_type(value):
+    # 'application/octet-stream; features=10' --> ('application/octet-stream', {'features': '10'})
+    mimetype, _, parameters = value.partition(';')
+    params = {}
+    for parameter in parameters.split(';'):
+        key, _, param = parameter.partition('=')
+        if key.strip():
+            params[key.strip().lower()] = param.strip().strip('"')
+    return mimetype.strip().lower(), params
+
+
+def score(body, content_type, params, model_name=None):
+    # Runs on the inference thread pool. Only a body that cannot be decoded is a 400,
+    # errors of the model raise and are a 500, like in the flask app
+    decoder, encoder = service.content_types[content_type]
+    try:
+        with service.stage_latency.labels('parse').time():
+            data = service.check_features(decoder(body, params), model_name)
+    except ValueError as e:
+        return 400, str(e)
+    service.row_count.inc(data.shape[0])
+    with service.stage_latency.labels('predict').time():
+        predictions = service.PredictionService.predict(data, model_name)
+    with service.stage_latency.labels('serialize').time():
+        return 200, encoder(predictions)
+
+
+async def read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+
+async def respond(send, status, body, content_type):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode('latin-1')), (b'content-length', str(len(body)).encode('latin-1'))]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def invoke(scope, receive, model_name=None):
+    loop = asyncio.get_running_loop()
+    headers = dict(scope['headers'])
+    content_type, params = parse_content_type(headers.get(b'content-type', b'').decode('latin-1'))
+    try:
+        # Load a named model before reading the body, so a missing model is a 404
+        model_name = service.target_model(model_name or headers.get(b'x-amzn-sagemaker-target-model', b'').decode('latin-1'))
+        if model_name is not None:
+            await loop.run_in_executor(executor, service.PredictionService.get_model, model_name)
+    except ValueError as e:
+        return 400, str(e), 'text/plain'
+    except service.ModelNotFoundError as e:
+        return 404, str(e), 'text/plain'
+    with service.stage_latency.labels('read').time():
+        body = await read_body(receive)
+    service.payload_size.labels('request').observe(len(body))
+    if content_type not in service.content_types:
+        return 415, "Invalid request data type, supported types are: {}.".format(', '.join(service.content_types)), 'text/plain'
+    status, result = await loop.run_in_executor(executor, score, body, content_type, params, model_name)
+    if status != 200:
+        return status, result, 'text/plain'
+    service.payload_size.labels('response').observe(len(result))
+    return 200, result, content_type
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Load the model before accepting requests, named models are loaded on demand
+            if not service.multi_model_enabled:
+                await asyncio.get_running_loop().run_in_executor(executor, service.PredictionService.get_model)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            executor.shutdown(wait=True)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    path, method = scope['path'], scope['method']
+    # '/models/<name>/invoke' --> ['', 'models', '<name>', 'invoke']
+    parts = path.split('/')
+    model_name = parts[2] if len(parts) == 4 and parts[1] == 'models' and parts[3] == 'invoke' else None
+    if path == '/ping' and method == 'GET':
+        if service.multi_model_enabled:
+            health = os.path.isdir(service.models_path)
+        else:
+            # Loaded at startup, so the health check never queues behind inference
+            health = service.PredictionService.tf_model is not None
+        await respond(send, 200 if health else 404, '\n', 'application/json')
+    elif path == '/reload' and method == 'POST':
+        response = service.reload()
+        await respond(send, response.status_code, response.get_data(), response.content_type)
+    elif path == '/metrics' and method == 'GET':
+        response = service.metrics()
+        await respond(send, response.status_code, response.get_data(), response.content_type)
+    elif (path == '/invocations' or model_name) and method == 'POST':
+        with service.in_flight_requests.track_inprogress():
+            try:
+                status, body, content_type = await invoke(scope, receive, model_name)
+            except Exception:
+                service.request_count.labels(500).inc()
+                raise
+        service.request_count.labels(status).inc()
+        await respond(send, status, body, content_type)
+    else:
+        await respond(send, 404, '{}', 'application/json')
@@ -0,0 +1,25 @@
+# Gunicorn server hooks, loaded with `gunicorn -c gunicorn_config.py`
+import os
+from prometheus_client import multiprocess
+
+
+def post_fork(server, worker):
+    # Opt-in: pin each worker to its own block of MODEL_SERVER_THREADS_PER_WORKER CPUs,
+    # so its thread pools stay on warm caches. A restarted worker takes the next block.
+    if os.environ.get('MODEL_SERVER_CPU_AFFINITY', 'false').lower() == 'true':
+        cpus = sorted(os.sched_getaffinity(0))
+        threads = int(os.environ.get('MODEL_SERVER_THREADS_PER_WORKER', 1))
+        slot = (worker.age - 1) % max(1, len(cpus) // threads)
+        os.sched_setaffinity(0, cpus[slot * threads:(slot + 1) * threads])
+        server.log.info('Worker %s pinned to CPUs %s', worker.pid, cpus[slot * threads:(slot + 1) * threads])
+    # With `--preload`, the app module was imported by the master. Models whose thread
+    # pools do not survive the fork are loaded and warmed here, in the worker.
+    if (os.environ.get('MODEL_SERVER_PRELOAD', 'false').lower() == 'true'
+            and os.environ.get('MODEL_SERVER_MULTI_MODEL', 'false').lower() != 'true'):
+        import app
+        app.warm_worker()
+
+
+def child_exit(server, worker):
+    # Drop the in-flight gauge of an exited worker from the aggregated `/metrics`
+    multiprocess.mark_process_dead(worker.pid)
@@ -2,16 +2,18 @@ import os
 import sys
 import json
 import re
+import time
+import inspect
+import threading
 import traceback
-import tensorflow as tf
 import numpy as np
 import pandas as pd
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Dense
-from tensorflow.keras.optimizers import Adam
 from sklearn import preprocessing
+from tflite_model import TFLiteModel
 
 tf.get_logger().setLevel('ERROR')
 
@@ -25,7 +27,342 @@ output_path = os.path.join(prefix, 'output')
 model_path = os.path.join(prefix, 'model')
 # These are the hyperparameters sent to the training algorithms through the Estimator
 param_path = os.path.join(prefix, 'input/config/hyperparameters.json')
+# The input mode of every channel, 'File' or 'Pipe'
+input_config_path = os.path.join(prefix, 'input/config/inputdataconfig.json')
+# The hosts of the training job and the host of this container
+resource_config_path = os.path.join(prefix, 'input/config/resourceconfig.json')
+# Port of the collective operations between the workers of a distributed training job
+worker_port = 2222
+# Sagemaker syncs this folder with `CheckpointConfig.S3Uri` and restores it when a
+# (spot) training job restarts
+checkpoint_path = os.path.join(prefix, 'checkpoints')
+# CPU flags of the hardware bfloat16 support mixed precision training is worth it on
+bf16_cpu_flags = ['avx512_bf16', 'amx_bf16']
+# Bytes read from a Pipe mode FIFO at a time
+pipe_chunk_bytes = 1024 * 1024
+# Columns of the abalone CSV files, `rings` is the label
+column_names = ["rings", "length", "diameter", "height", "whole weight",
+        "shucked weight", "viscera weight", "shell weight", "sex_F", "sex_I", "sex_M"]
+
+
+# Read the channel configuration written by SageMaker
+def input_channels():
+    if not os.path.exists(input_config_path):
+        return {}
+    with open(input_config_path, 'r') as ic:
+        return json.load(ic)
+
+# Read the cluster layout written by SageMaker: the hosts and the index of this host
+def cluster_hosts():
+    if not os.path.exists(resource_config_path):
+        return ['localhost'], 0
+    with open(resource_config_path, 'r') as rc:
+        config = json.load(rc)
+    return config['hosts'], config['hosts'].index(config['current_host'])
+
+# Synchronous data parallel training across the hosts: every step all-reduces the gradients
+# of all the workers, so the replicas of the model stay identical. `TF_CONFIG` describes the
+# cluster to TensorFlow and must be set before the first TensorFlow operation runs.
+def distribution_strategy(hosts, index):
+    workers = [host if ':' in host else '{}:{}'.format(host, worker_port) for host in hosts]
+    os.environ['TF_CONFIG'] = json.dumps({'cluster': {'worker': workers}, 'task': {'type': 'worker', 'index': index}})
+    return tf.distribute.MultiWorkerMirroredStrategy()
+
+# Keep every `workers`-th record, starting at `index`. The remainder is dropped so that
+# every worker runs the same number of steps, which the all-reduce waits on.
+def shard_arrays(X, y, workers, index):
+    rows = len(y) // workers * workers
+    return X[index:rows:workers], y[index:rows:workers]
+
+# Batch in-memory arrays for a distributed `fit`
+def array_dataset(X, y, batch_size, shuffle=False):
+    dataset = tf.data.Dataset.from_tensor_slices((X, y))
+    if shuffle:
+        dataset = dataset.shuffle(len(y), reshuffle_each_iteration=True)
+    return dataset.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+# The datasets are sharded by hand, turn off TensorFlow's own sharding between the workers
+def without_auto_shard(dataset):
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return dataset.with_options(options)
+
+# Parse complete CSV lines into a 2-D NumPy array
+def parse_csv_lines(lines):
+    rows = [line for line in lines if line.strip()]
+    if len(rows) == 0:
+        return None
+    # Ragged records would otherwise shift values across rows in the reshape
+    widths = set(row.count(b',') + 1 for row in rows)
+    if len(widths) != 1:
+        raise ValueError("Every record must contain the same number of columns, found {}.".format(sorted(widths)))
+    width = widths.pop()
+    values = np.fromstring(b','.join(rows).decode('utf-8'), sep=',')
+    if values.size != len(rows) * width:
+        raise ValueError("Every record must contain {} numeric columns.".format(width))
+    return values.reshape(len(rows), width)
+
+# Stream the CSV records of a Pipe mode channel from its FIFO, parsing them as they arrive
+def read_pipe(channel, epoch=0):
+    print("Reading channel '{}' in Pipe mode ...".format(channel))
+    blocks = []
+    remainder = b''
+    # SageMaker creates one FIFO per pass over the channel, named `<channel>_<epoch>`
+    with open(os.path.join(input_path, '{}_{}'.format(channel, epoch)), 'rb') as fifo:
+        while True:
+            chunk = fifo.read(pipe_chunk_bytes)
+            if not chunk:
+                break
+            lines = (remainder + chunk).split(b'\n')
+            # The last line may continue in the next chunk
+            remainder = lines.pop()
+            block = parse_csv_lines(lines)
+            if block is not None:
+                blocks.append(block)
+    block = parse_csv_lines([remainder])
+    if block is not None:
+        blocks.append(block)
+    if len(blocks) == 0:
+        raise ValueError("No records were received on the '{}' channel.".format(channel))
+    return np.concatenate(blocks)
+
+# Load a CSV file into memory as normalized features and labels, or its first `nrows` records
+def load_arrays(path, nrows=None):
+    data = pd.read_csv(path, sep=',', names=column_names, nrows=nrows)
+    # Split the data for training features vs. predictor
+    y = data['rings'].to_numpy()
+    X = data.drop(['rings'], axis=1).to_numpy()
+    # Normalize the data
+    return preprocessing.normalize(X), y
+
+# Decode a batch of CSV lines and normalize every row in the graph, like `preprocessing.normalize`
+def parse_batch(lines):
+    columns = tf.io.decode_csv(lines, record_defaults=[[0.0]] * len(column_names))
+    features = tf.math.l2_normalize(tf.stack(columns[1:], axis=1), axis=1)
+    return features, columns[0]
+
+# Number of records of a CSV file
+def count_lines(path):
+    with open(path, 'rb') as f:
+        return sum(1 for _ in f)
+
+# Stream a CSV file from disk: lines are shuffled in a bounded buffer, parsed in parallel
+# batches and prefetched, so that reading overlaps training and memory stays flat. With
+# several workers each one reads its own shard of the lines, as in `shard_arrays`.
+def make_dataset(path, batch_size, shuffle_buffer=0, workers=1, index=0):
+    dataset = tf.data.TextLineDataset(path)
+    if workers > 1:
+        dataset = dataset.take(count_lines(path) // workers * workers).shard(workers, index)
+    if shuffle_buffer > 0:
+        dataset = dataset.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(parse_batch, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+# Log the duration of every epoch
+class EpochTimer(keras.callbacks.Callback):
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.started = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.times.append(time.perf_counter() - self.started)
+        print("Epoch {} took {:.3f} seconds.".format(epoch + 1, self.times[-1]))
+
+# Log the training throughput of every epoch, and report the samples per second and the
+# best validation MAE of the run, to compare the execution options of the hyperparameters
+class ThroughputReport(EpochTimer):
+    def __init__(self, samples, configuration):
+        super().__init__()
+        self.samples = samples
+        self.configuration = configuration
+        self.val_mae = []
+
+    def on_epoch_end(self, epoch, logs=None):
+        super().on_epoch_end(epoch, logs)
+        if logs is not None and 'val_mae' in logs:
+            self.val_mae.append(float(logs['val_mae']))
+
+    def on_train_end(self, logs=None):
+        if len(self.times) == 0:
+            return
+        # The first epoch includes tracing and compiling the train step
+        self.samples_per_sec = self.samples / float(np.median(self.times[1:] or self.times))
+        print("Configuration: {}".format(', '.join('{}={}'.format(key, value) for key, value in self.configuration.items())))
+        print("train:samples_per_sec={:.1f};".format(self.samples_per_sec))
+        if self.val_mae:
+            print("validation:mae={:.4f};".format(min(self.val_mae)))
+
+def is_enabled(value):
+    # Hyperparameters arrive as strings
+    return str(value).lower() in ['true', '1', 'yes']
+
+# Whether the CPU computes in bfloat16 natively, otherwise mixed precision is slower
+def cpu_supports_bf16(cpuinfo_path='/proc/cpuinfo'):
+    try:
+        with open(cpuinfo_path, 'r') as f:
+            flags = set(f.read().split())
+    except OSError:
+        return False
+    return any(flag in flags for flag in bf16_cpu_flags)
+
+# Set the precision of the layers built from now on: 'mixed_bfloat16' computes in bfloat16
+# with float32 variables, when the `mixed_precision` hyperparameter is set and the CPU supports it
+def set_precision(params):
+    policy = 'float32'
+    if is_enabled(params.get('mixed_precision', 'false')):
+        if cpu_supports_bf16():
+            policy = 'mixed_bfloat16'
+        else:
+            print("The CPU has no bfloat16 support, training in float32.")
+    keras.mixed_precision.set_global_policy(policy)
+    return policy
+
+# Compile the model with the execution options of the hyperparameters. `jit_compile`
+# compiles the train step with XLA and `steps_per_execution` runs several steps per call
+# into the graph, both cut the per-step Python overhead of small batches. With
+# `base_batch_size`, the learning rate scales linearly with the (global) batch size.
+def compile_model(model, params, batch_size):
+    learning_rate = float(params.get('learning_rate', 0.001))
+    if 'base_batch_size' in params:
+        learning_rate *= batch_size / float(params['base_batch_size'])
+    options = {'steps_per_execution': int(params.get('steps_per_execution', 1))}
+    if 'jit_compile' in params:
+        if 'jit_compile' in inspect.signature(model.compile).parameters:
+            options['jit_compile'] = is_enabled(params['jit_compile'])
+        elif is_enabled(params['jit_compile']):
+            # Before TensorFlow 2.8, cluster the graphs for XLA instead
+            tf.config.optimizer.set_jit(True)
+    model.compile(loss='mse', optimizer=keras.optimizers.Adam(learning_rate=learning_rate),
+                  metrics=['mae','accuracy'], **options)
+    return learning_rate
+
+# Early stopping that carries its patience counter and best loss across a restart
+class ResumableEarlyStopping(keras.callbacks.EarlyStopping):
+    def __init__(self, state=None, **kwargs):
+        super().__init__(**kwargs)
+        self.resume_state = state or {}
+
+    def on_train_begin(self, logs=None):
+        super().on_train_begin(logs)
+        for key, value in self.resume_state.items():
+            setattr(self, key, value)
+
+    def get_state(self):
+        state = {'wait': int(self.wait)}
+        if getattr(self, 'best', None) is not None:
+            state['best'] = float(self.best)
+        if hasattr(self, 'best_epoch'):
+            state['best_epoch'] = int(self.best_epoch)
+        return state
+
+def optimizer_variables(optimizer):
+    # A property in Keras 3 and a method in the `tf.keras` optimizers
+    variables = optimizer.variables
+    return variables() if callable(variables) else variables
+
+# Write checkpoints on a background thread, so that writing a checkpoint never stalls
+# training. Training only pays for copying the weights; if a write is still running
+# when the next checkpoint is taken, the older pending one is skipped.
+class AsyncCheckpoint(keras.callbacks.Callback):
+    def __init__(self, path, every, early_stop):
+        super().__init__()
+        self.path = path
+        self.every = every
+        self.early_stop = early_stop
+        self.pending = None
+        self.condition = threading.Condition()
+        self.writing = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def on_train_begin(self, logs=None):
+        self.last_epoch = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.last_epoch = epoch
+        if (epoch + 1) % self.every == 0:
+            self.snapshot(epoch)
+
+    def on_train_end(self, logs=None):
+        # Always keep the final state, e.g. after early stopping between two checkpoints
+        if self.last_epoch is not None:
+            self.snapshot(self.last_epoch)
+        self.flush()
+
+    def snapshot(self, epoch):
+        arrays = {'weight_{}'.format(i): value for i, value in enumerate(self.model.get_weights())}
+        for i, variable in enumerate(optimizer_variables(self.model.optimizer)):
+            arrays['optimizer_{}'.format(i)] = np.array(variable.numpy())
+        arrays['state'] = np.array(json.dumps({'epoch': epoch, 'early_stopping': self.early_stop.get_state()}))
+        with self.condition:
+            self.pending = arrays
+            self.condition.notify()
 
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None:
+                    self.condition.wait()
+                arrays, self.pending = self.pending, None
+                self.writing = True
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                # Write then rename, so that an interruption never leaves a partial checkpoint
+                temp = os.path.join(self.path, 'checkpoint.tmp.npz')
+                np.savez(temp, **arrays)
+                os.replace(temp, os.path.join(self.path, 'checkpoint.npz'))
+            except Exception:
+                print('Checkpoint write failed:\n' + traceback.format_exc(), file=sys.stderr)
+            with self.condition:
+                self.writing = False
+                self.condition.notify_all()
+
+    def flush(self):
+        with self.condition:
+            while self.pending is not None or self.writing:
+                self.condition.wait()
+
+# Restore the weights, optimizer state and early stopping state of the latest checkpoint
+def restore_checkpoint(model, path):
+    checkpoint = os.path.join(path, 'checkpoint.npz')
+    if not os.path.exists(checkpoint):
+        return 0, None
+    with np.load(checkpoint) as arrays:
+        state = json.loads(str(arrays['state']))
+        model.set_weights([arrays['weight_{}'.format(i)] for i in range(len(model.get_weights()))])
+        # Create the optimizer slots before assigning them, `build` is missing before TensorFlow 2.11
+        if hasattr(model.optimizer, 'build'):
+            model.optimizer.build(model.trainable_variables)
+        else:
+            model.optimizer._create_all_weights(model.trainable_variables)
+        variables = optimizer_variables(model.optimizer)
+        saved = sorted((key for key in arrays.files if key.startswith('optimizer_')), key=lambda key: int(key.split('_')[1]))
+        if len(saved) == len(variables):
+            for variable, key in zip(variables, saved):
+                variable.assign(arrays[key])
+        else:
+            print("Checkpoint optimizer state does not match the optimizer, restarting it.")
+    print("Resuming from the checkpoint of epoch {}.".format(state['epoch'] + 1))
+    return state['epoch'] + 1, state['early_stopping']
+
+# Build the DNN layers of the abalone regression model
+def build_model(layers, dense_layer):
+    # Initialize weight tensors with a normal "Xavier" distribution
+    initializer = tf.keras.initializers.GlorotNormal()
+    dense_layers = []
+    # Build Deep layers
+    for layer in range(layers):
+        if layer == 0:
+            dense_layers.append(Dense(dense_layer, kernel_initializer=initializer, input_dim=10))
+        else:
+            dense_layers.append(Dense(dense_layer, activation='relu'))
+    # Add final linear `pass-through` layer, in float32 under mixed precision
+    dense_layers.append(Dense(1, activation='linear', dtype='float32'))
+    return Sequential(dense_layers)
 
 # Define function called for training
 def train():
@@ -50,69 +387,148 @@ def train():
                     value = int(value)
                 params[key] = value
 
-        # Confirm that training files exists and the channel was correctly configured
-        input_files = [ os.path.join(training_path, file) for file in os.listdir(training_path) ]
-        if len(input_files) == 0:
-            raise ValueError(('There are no files in {}.\\n' +
-                              'This usually indicates that the channel ({}) was incorrectly specified,\\n' +
-                              'the data specification in S3 was incorrectly specified or the role specified\\n' +
-                              'does not have permission to access the data.').format(training_path, channel_name))
-        
-        # Specify the Column names in order to manipulate the specific columns for pre-processing
-        column_names = ["rings", "length", "diameter", "height", "whole weight", 
-                "shucked weight", "viscera weight", "shell weight", "sex_F", "sex_I", "sex_M"]
-        
-        # Load the training dataset
-        train_data = pd.read_csv(os.path.join(training_path, 'train.csv'), sep=',', names=column_names)
-        
-        # Load the validation dataset
-        val_data = pd.read_csv(os.path.join(training_path, 'validate.csv'), sep=',', names=column_names)
-
-        # Split the data for training features vs. predictor
-        train_y = train_data['rings'].to_numpy()
-        train_X = train_data.drop(['rings'], axis=1).to_numpy()
-        val_y = val_data['rings'].to_numpy()
-        val_X = val_data.drop(['rings'], axis=1).to_numpy()
-
-        # Normalize the data
-        train_X = preprocessing.normalize(train_X)
-        val_X = preprocessing.normalize(val_X)
-        
-        # Prevent overtraining to minimize model overfitting the data
-        early_stop = keras.callbacks.EarlyStopping(monitor='val_loss', patience=10)
+        # Several hosts train one model together, the first host is the chief
+        hosts, host_index = cluster_hosts()
+        workers = len(hosts)
+        is_chief = host_index == 0
+        if workers > 1:
+            print("Training on host {} of {}: {}".format(host_index + 1, workers, ', '.join(hosts)))
+            strategy = distribution_strategy(hosts, host_index)
+        else:
+            strategy = tf.distribute.get_strategy()
+
+        channels = input_channels()
+        # 'memory' loads the CSV files with pandas, 'stream' reads them with `tf.data`
+        input_pipeline = params.get('input_pipeline', 'memory')
+        streaming = False
+        if channels.get(channel_name, {}).get('TrainingInputMode') == 'Pipe':
+            # In Pipe mode the records are streamed through a FIFO instead of being downloaded
+            # first. The files of a channel arrive as one stream, so the validation records
+            # come from a 'validation' channel, or are held out from the training records.
+            train_data = read_pipe(channel_name)
+            if 'validation' in channels:
+                val_data = read_pipe('validation')
+            else:
+                val_rows = int(len(train_data) * params.get('validation_split', 0.2))
+                train_data, val_data = train_data[:len(train_data) - val_rows], train_data[len(train_data) - val_rows:]
+
+            # Split the data for training features vs. predictor, `rings` is the first column
+            train_y, train_X = train_data[:, 0], train_data[:, 1:]
+            val_y, val_X = val_data[:, 0], val_data[:, 1:]
+            # Normalize the data
+            train_X = preprocessing.normalize(train_X)
+            val_X = preprocessing.normalize(val_X)
+        else:
+            # Confirm that training files exists and the channel was correctly configured
+            input_files = [ os.path.join(training_path, file) for file in os.listdir(training_path) ]
+            if len(input_files) == 0:
+                raise ValueError(('There are no files in {}.\\n' +
+                                  'This usually indicates that the channel ({}) was incorrectly specified,\\n' +
+                                  'the data specification in S3 was incorrectly specified or the role specified\\n' +
+                                  'does not have permission to access the data.').format(training_path, channel_name))
+
+            if input_pipeline == 'stream':
+                streaming = True
+                train_dataset = make_dataset(os.path.join(training_path, 'train.csv'), params.get('batch_size', 32),
+                                             shuffle_buffer=int(params.get('shuffle_buffer', 10000)),
+                                             workers=workers, index=host_index)
+                val_dataset = make_dataset(os.path.join(training_path, 'validate.csv'), params.get('batch_size', 32),
+                                           workers=workers, index=host_index)
+            else:
+                # Load the training and validation datasets
+                train_X, train_y = load_arrays(os.path.join(training_path, 'train.csv'))
+                val_X, val_y = load_arrays(os.path.join(training_path, 'validate.csv'))
         
-        # Build the DNN layers
+        # Records to calibrate and check a quantized copy of the model with, before sharding
+        if params.get('quantize'):
+            if streaming:
+                calibration_X, _ = load_arrays(os.path.join(training_path, 'train.csv'),
+                                               nrows=10 * int(params.get('quantize_samples', 500)))
+                check_X, check_y = load_arrays(os.path.join(training_path, 'validate.csv'))
+            else:
+                calibration_X, check_X, check_y = train_X, val_X, val_y
+
+        if workers > 1:
+            # Every worker trains on its own shard, in batches of `batch_size` records
+            if not streaming:
+                train_X, train_y = shard_arrays(train_X, train_y, workers, host_index)
+                val_X, val_y = shard_arrays(val_X, val_y, workers, host_index)
+                train_dataset = array_dataset(train_X, train_y, params.get('batch_size', 32), shuffle=True)
+                val_dataset = array_dataset(val_X, val_y, params.get('batch_size', 32))
+                streaming = True
+            train_dataset = without_auto_shard(train_dataset)
+            val_dataset = without_auto_shard(val_dataset)
+
+        # Records per epoch across all the workers, for the throughput report
+        if streaming and workers == 1:
+            samples = count_lines(os.path.join(training_path, 'train.csv'))
+        elif streaming:
+            samples = count_lines(os.path.join(training_path, 'train.csv')) // workers * workers
+        else:
+            samples = len(train_y) * workers
+
+        # Build the DNN layers, the variables are mirrored on every worker
         algorithm = 'TensorflowRegression'
         print("Training Algorithm: %s" % algorithm)
-        # Initialize weight tensors with a normal "Xavier" distribution
-        initializer = tf.keras.initializers.GlorotNormal()
-        dense_layers = []
-        # Build Deep layers
-        for layer in range(int(params.get('layers'))):
-            if layer == 0:
-                dense_layers.append(Dense(params.get('dense_layer'), kernel_initializer=initializer, input_dim=10))
-            else:
-                dense_layers.append(Dense(params.get('dense_layer'), activation='relu'))
-        # Add final linear `pass-through` layer
-        dense_layers.append(Dense(1, activation='linear'))
-        
-        # Build the model
-        model = Sequential(dense_layers)
-        model.summary()
-        
-        # Compile and train the model
-        model.compile(loss='mse', optimizer='adam', metrics=['mae','accuracy'])
-        model.fit(
-            train_X,
-            train_y,
-            validation_data=(val_X, val_y),
-            batch_size=params.get('batch_size'),
-            epochs=params.get('epochs'),
-            shuffle=True,
-            verbose=1,
-            callbacks=[early_stop]
-        )
-        
+        precision = set_precision(params)
+        with strategy.scope():
+            model = build_model(int(params.get('layers')), params.get('dense_layer'))
+            model.summary()
+
+            # Compile and train the model
+            batch_size = params.get('batch_size', 32)
+            learning_rate = compile_model(model, params, batch_size * workers)
+
+            # Resume from the latest checkpoint after an interruption, e.g. of spot capacity
+            initial_epoch, early_stop_state = restore_checkpoint(model, checkpoint_path)
+
+        # Prevent overtraining to minimize model overfitting the data. The validation loss
+        # is reduced across the workers, so that they all stop at the same epoch.
+        early_stop = ResumableEarlyStopping(early_stop_state, monitor='val_loss', patience=10)
+        report = ThroughputReport(samples, {
+            'workers': workers, 'batch_size': batch_size, 'learning_rate': learning_rate, 'precision': precision,
+            'jit_compile': params.get('jit_compile', 'default'), 'steps_per_execution': params.get('steps_per_execution', 1)})
+        callbacks = [early_stop, report]
+        if is_chief:
+            callbacks.insert(1, AsyncCheckpoint(checkpoint_path, int(params.get('checkpoint_epochs', 10)), early_stop))
+
+        if streaming:
+            # The datasets batch and shuffle the records themselves
+            model.fit(
+                train_dataset,
+                validation_data=val_dataset,
+                epochs=params.get('epochs'),
+                initial_epoch=initial_epoch,
+                verbose=1,
+                callbacks=callbacks
+            )
+        else:
+            model.fit(
+                train_X,
+                train_y,
+                validation_data=(val_X, val_y),
+                batch_size=batch_size,
+                epochs=params.get('epochs'),
+                initial_epoch=initial_epoch,
+                shuffle=True,
+                verbose=1,
+                callbacks=callbacks
+            )
+
+        # The replicas are identical, only the chief writes the model artifacts
+        if not is_chief:
+            print("Worker {} finished training.".format(host_index))
+            return
+
+        if precision != 'float32' or workers > 1:
+            # Serve the trained weights from a float32 copy of the model, built outside the
+            # strategy: predicting with the distributed model runs collective ops, which would
+            # wait on the workers that already finished
+            keras.mixed_precision.set_global_policy('float32')
+            trained = model
+            model = build_model(int(params.get('layers')), params.get('dense_layer'))
+            model.set_weights(trained.get_weights())
+
         # Save the model as a single 'h5' file without the optimizer
         print("Saving Model ...")
         model.save(
@@ -122,6 +538,15 @@ def train():
             save_format="h5"
         )
 
+        # Export the layer weights for the NumPy serving backend
+        export_numpy(model, os.path.join(model_path, 'model.npz'))
+
+        # Publish a quantized copy for the TensorFlow Lite serving backend, if it stays accurate
+        if params.get('quantize'):
+            quantize_model(model, params.get('quantize'), calibration_X, check_X, check_y,
+                           samples=int(params.get('quantize_samples', 500)),
+                           tolerance=float(params.get('quantize_tolerance', 0.1)))
+
     except Exception as e:
         # Write out an error file. This will be returned as the failureReason in the
         # `DescribeTrainingJob` result.
@@ -135,6 +560,69 @@ def train():
         # A non-zero exit code causes the training job to be marked as Failed.
         sys.exit(255)
 
+# Export the `Dense` layer weights and activations to a compact array file
+def export_numpy(model, path):
+    print("Exporting NumPy Model ...")
+    weights = {}
+    activations = []
+    for index, layer in enumerate(model.layers):
+        if not isinstance(layer, Dense):
+            raise ValueError("Only 'Dense' layers can be exported, found '{}'".format(layer.name))
+        kernel, bias = layer.get_weights()
+        weights['kernel_{}'.format(index)] = kernel
+        weights['bias_{}'.format(index)] = bias
+        activations.append(tf.keras.activations.serialize(layer.activation))
+    np.savez(path, activations=np.array(activations), **weights)
+
+# Convert the model to a post-training quantized TensorFlow Lite flatbuffer. 'float16'
+# stores the weights in half precision, 'int8' quantizes the weights and activations,
+# with the activation ranges calibrated on `calibration_X`.
+def export_tflite(model, mode, calibration_X):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == 'int8':
+        def representative_dataset():
+            for row in calibration_X:
+                yield [row.reshape(1, -1).astype(np.float32)]
+        converter.representative_dataset = representative_dataset
+        # The inputs and outputs stay float32, so requests are served unchanged
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    else:
+        raise ValueError("Unsupported quantization '{}', use 'int8' or 'float16'".format(mode))
+    return converter.convert()
+
+# Quantize the model and compare its MAE with the float model on the validation records.
+# `model.tflite` is only published when the MAE rises by at most `tolerance`, and the
+# comparison is recorded in `quantization.json` either way.
+def quantize_model(model, mode, calibration_X, val_X, val_y, samples=500, tolerance=0.1):
+    print("Quantizing Model ({}) ...".format(mode))
+    rows = np.random.RandomState(0).permutation(len(calibration_X))[:samples]
+    content = export_tflite(model, mode, calibration_X[rows])
+    float_mae = float(np.mean(np.abs(model.predict(val_X, verbose=0).ravel() - val_y)))
+    quantized_mae = float(np.mean(np.abs(TFLiteModel.from_content(content).predict(val_X).ravel() - val_y)))
+    report = {
+        'mode': mode,
+        'float_mae': float_mae,
+        'quantized_mae': quantized_mae,
+        'mae_delta': quantized_mae - float_mae,
+        'tolerance': tolerance,
+        'bytes': len(content),
+        'published': quantized_mae - float_mae <= tolerance
+    }
+    print("validation:quantized_mae={:.4f};".format(quantized_mae))
+    if report['published']:
+        with open(os.path.join(model_path, 'model.tflite'), 'wb') as f:
+            f.write(content)
+        print("Published the {} model, {} bytes, MAE {:+.4f}.".format(mode, len(content), report['mae_delta']))
+    else:
+        print("Not publishing the {} model, MAE {:+.4f} exceeds the tolerance of {}.".format(
+            mode, report['mae_delta'], tolerance), file=sys.stderr)
+    with open(os.path.join(model_path, 'quantization.json'), 'w') as f:
+        json.dump(report, f, indent=4)
+    return report
+
 # Define function called for local testing
 def predict(payload, algorithm):
     print("Local Testing Mode ...")
@@ -0,0 +1,52 @@
+import numpy as np
+
+# Element-wise activations supported by the exported `Dense` layers
+activations = {
+    'linear': lambda x: x,
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'sigmoid': lambda x: 1 / (1 + np.exp(-x)),
+    'tanh': np.tanh
+}
+
+
+class NumpyModel(object):
+    """
+    Description:
+    -----------
+    Evaluates the abalone `Dense` network with plain NumPy matmuls, from the
+    weights exported by `model.export_numpy()`. Serving through this class
+    does not import TensorFlow.
+
+    :layers: (list) List of `(kernel, bias, activation)` tuples.
+    """
+    def __init__(self, layers):
+        self.layers = layers
+        # Row width of the input, from the first kernel
+        self.features = layers[0][0].shape[0]
+
+    @classmethod
+    def load(cls, path):
+        """
+        Description:
+        -----------
+        Loads the exported layer weights and activations from a `.npz` file.
+
+        :path: (str) Path to the `model.npz` file.
+
+        :returns: (NumpyModel) The loaded network.
+        """
+        with np.load(path) as weights:
+            layers = []
+            for index, activation in enumerate(weights['activations']):
+                if str(activation) not in activations:
+                    raise ValueError("Unsupported activation '{}'".format(activation))
+                layers.append((np.ascontiguousarray(weights['kernel_{}'.format(index)], dtype=np.float32),
+                               np.ascontiguousarray(weights['bias_{}'.format(index)], dtype=np.float32),
+                               activations[str(activation)]))
+        return cls(layers)
+
+    def predict(self, input):
+        x = np.asarray(input, dtype=np.float32)
+        for kernel, bias, activation in self.layers:
+            x = activation(np.matmul(x, kernel) + bias)
+        return x
@@ -0,0 +1,64 @@
+import threading
+import numpy as np
+
+# The standalone interpreter packages, without the rest of TensorFlow, before TensorFlow itself.
+# The training image ships `tf.lite`, installing `tflite-runtime` there would upgrade its NumPy.
+try:
+    from ai_edge_litert.interpreter import Interpreter
+except ImportError:
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+
+
+class TFLiteModel(object):
+    """
+    Description:
+    -----------
+    Serves the quantized abalone network exported by `model.export_tflite()` with
+    the TensorFlow Lite interpreter. The input tensor is resized whenever the
+    number of records in a batch changes.
+
+    :interpreter: (Interpreter) Interpreter holding the quantized model.
+    """
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.input_index = interpreter.get_input_details()[0]['index']
+        self.output_index = interpreter.get_output_details()[0]['index']
+        # Row width of the input
+        self.features = int(interpreter.get_input_details()[0]['shape'][-1])
+        self.shape = None
+        # An interpreter runs one invocation at a time
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, num_threads=None):
+        """
+        Description:
+        -----------
+        Loads a `.tflite` flatbuffer.
+
+        :path: (str) Path to the `model.tflite` file.
+        :num_threads: (int) Threads of the interpreter, its default if `None`.
+
+        :returns: (TFLiteModel) The loaded network.
+        """
+        return cls(Interpreter(model_path=path, num_threads=num_threads))
+
+    @classmethod
+    def from_content(cls, content):
+        # Wraps a flatbuffer held in memory, e.g. straight out of the converter
+        return cls(Interpreter(model_content=content))
+
+    def predict(self, input):
+        x = np.ascontiguousarray(input, dtype=np.float32)
+        with self.lock:
+            if x.shape != self.shape:
+                self.interpreter.resize_tensor_input(self.input_index, x.shape)
+                self.interpreter.allocate_tensors()
+                self.shape = x.shape
+            self.interpreter.set_tensor(self.input_index, x)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).copy()
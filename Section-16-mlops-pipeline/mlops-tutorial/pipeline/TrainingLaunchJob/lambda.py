@@ -44,6 +44,9 @@ def handler(event, context):
         trainingJob['TrainingJobName'] = "mlops-{}-{}".format(model_name, executionId)
         trainingJob['OutputDataConfig']['S3OutputPath'] = os.path.join('s3://', pipeline_bucket, executionId)
         trainingJob['InputDataConfig'][0]['DataSource']['S3DataSource']['S3Uri'] = os.path.join('s3://', pipeline_bucket, executionId, 'input/training')
+        if 'CheckpointConfig' in trainingJob:
+            # Checkpoints of this execution, restored when the training job is restarted
+            trainingJob['CheckpointConfig']['S3Uri'] = os.path.join('s3://', pipeline_bucket, executionId, 'checkpoints')
         trainingJob['Tags'].append({'Key': 'jobid', 'Value': jobId})
         logger.info(trainingJob)
         sm.create_training_job(**trainingJob)
@@ -9,8 +9,12 @@ payload = "6.550000000000000266e-01,5.200000000000000178e-01,1.90000000000000002
 1.454499999999999904e+00,5.999999999999999778e-01,3.865000000000000102e-01,\
 3.829999999999999516e-01,1.000000000000000000e+00,0.000000000000000000e+00,0.000000000000000000e+00"
 
+# Multi-record request payload: one observation per line
+batch_payload = "\n".join([payload] * 3)
+
 # Encode payload to Bytes for `request()
 payload = payload.encode('utf-8')
+batch_payload = batch_payload.encode('utf-8')
 
 
 def predict(payload, headers):
@@ -19,7 +23,7 @@ def predict(payload, headers):
     -----------
     Prediction request to the local API.
     
-    :payload: (Bytes) Bytes encoded string of `abalone` features for a single observation.
+    :payload: (Bytes) Bytes encoded string of `abalone` features, one observation per line.
     :headers: (dict) Dictionary specifying the request content type.
     """
     req = request.Request("%s/invocations" % base_url, data=payload, headers=headers)
@@ -33,6 +37,8 @@ def main():
         resp = request.urlopen("%s/ping" % base_url)
         print("\nPING Response code: %d" % resp.getcode())
         predict(payload, headers)
+    print("\nStarting Batch Test ...")
+    predict(batch_payload, headers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,56 @@
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+
+# Import the training module from the `model` folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model'))
+import model
+
+validate_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input/data/training/validate.csv')
+
+
+def fit(network, X, y, path, epochs, initial_epoch=0, state=None):
+    early_stop = model.ResumableEarlyStopping(state, monitor='val_loss', patience=10)
+    checkpoint = model.AsyncCheckpoint(path, 2, early_stop)
+    network.fit(X, y, validation_split=0.2, epochs=epochs, initial_epoch=initial_epoch, batch_size=32,
+                verbose=0, callbacks=[early_stop, checkpoint])
+    return early_stop
+
+
+def build():
+    network = model.build_model(2, 16)
+    network.compile(loss='mse', optimizer='adam', metrics=['mae'])
+    return network
+
+
+def main():
+    print("\nStarting Checkpoint Test ...")
+    X, y = model.load_arrays(validate_path)
+    path = tempfile.mkdtemp()
+    try:
+        # Nothing to resume from on the first start
+        first = build()
+        assert model.restore_checkpoint(first, path) == (0, None)
+        early_stop = fit(first, X, y, path, epochs=3)
+
+        # A restarted job picks up after the last epoch with the same state
+        second = build()
+        initial_epoch, state = model.restore_checkpoint(second, path)
+        assert initial_epoch == 3, initial_epoch
+        assert state == early_stop.get_state(), state
+        for expected, actual in zip(first.get_weights(), second.get_weights()):
+            np.testing.assert_array_equal(expected, actual)
+        for expected, actual in zip(model.optimizer_variables(first.optimizer), model.optimizer_variables(second.optimizer)):
+            np.testing.assert_array_equal(expected.numpy(), actual.numpy())
+
+        fit(second, X, y, path, epochs=5, initial_epoch=initial_epoch, state=state)
+        assert model.restore_checkpoint(build(), path)[0] == 5
+        print("Resumed training from epoch {} with the checkpointed state".format(initial_epoch))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
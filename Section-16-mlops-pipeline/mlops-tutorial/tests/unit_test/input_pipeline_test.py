@@ -0,0 +1,37 @@
+import os
+import sys
+import numpy as np
+
+# Import the training module from the `model` folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model'))
+import model
+
+validate_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input/data/training/validate.csv')
+
+
+def main():
+    print("\nStarting Input Pipeline Test ...")
+    expected_X, expected_y = model.load_arrays(validate_path)
+    # Without shuffling the streamed batches come in file order
+    batches = list(model.make_dataset(validate_path, batch_size=64).as_numpy_iterator())
+    actual_X = np.concatenate([features for features, _ in batches])
+    actual_y = np.concatenate([labels for _, labels in batches])
+    np.testing.assert_allclose(actual_X, expected_X, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(actual_y, expected_y)
+    print("Streaming and in-memory pipelines match for {} observations".format(len(actual_y)))
+
+    # Distributed training: the workers get disjoint shards of equal size, in both pipelines
+    workers = 3
+    shards = []
+    for index in range(workers):
+        shard_X, shard_y = model.shard_arrays(expected_X, expected_y, workers, index)
+        batches = list(model.make_dataset(validate_path, batch_size=64, workers=workers, index=index).as_numpy_iterator())
+        np.testing.assert_allclose(np.concatenate([features for features, _ in batches]), shard_X, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(np.concatenate([labels for _, labels in batches]), shard_y)
+        shards.append(len(shard_y))
+    assert len(set(shards)) == 1 and sum(shards) > len(expected_y) - workers, shards
+    print("{} worker shards of {} observations match".format(workers, shards[0]))
+
+
+if __name__ == "__main__":
+    main()
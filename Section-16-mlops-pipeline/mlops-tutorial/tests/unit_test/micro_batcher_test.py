@@ -0,0 +1,43 @@
+import os
+import sys
+import threading
+import numpy as np
+
+# Import the serving module from the `model` folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model'))
+from app import MicroBatcher
+
+
+def main():
+    batches = []
+    def predict(data):
+        batches.append(data.shape)
+        # One prediction per row that identifies the row
+        return data.sum(axis=1, keepdims=True)
+
+    max_batch_size = 10
+    batcher = MicroBatcher(predict, max_batch_size, max_delay=0.05)
+    # Requests that overflow a batch, a request of another width and one larger than a batch
+    requests = [np.arange(4 * 3, dtype=np.float32).reshape(4, 3) + 100 * index for index in range(5)]
+    requests += [np.ones((2, 5), dtype=np.float32), np.ones((12, 3), dtype=np.float32)]
+    results = [None] * len(requests)
+    def call(index):
+        results[index] = batcher.predict(requests[index])
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(len(requests))]
+
+    print("\nStarting Micro-Batching Test ...")
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for request, result in zip(requests, results):
+        np.testing.assert_array_equal(result, request.sum(axis=1, keepdims=True))
+    assert all(rows <= max_batch_size for rows, _ in batches if rows != 12), batches
+    assert (12, 3) in batches and (2, 5) in batches, batches
+    assert len(batches) < len(requests), batches
+    print("Scored {} requests in batches of {}, results returned in request order".format(len(requests), batches))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import shutil
+import tempfile
+
+# Import the serving module from the `model` folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model'))
+from app import ModelPool, ModelNotFoundError
+
+
+def main():
+    root = tempfile.mkdtemp()
+    try:
+        for name in ['a', 'b', 'c', 'broken']:
+            os.makedirs(os.path.join(root, name))
+            with open(os.path.join(root, name, 'model.npz'), 'wb') as f:
+                f.write(b'\0' * 1000)
+
+        failures = {'broken': 1}
+        def loader(path):
+            name = os.path.basename(path)
+            if failures.get(name, 0) > 0:
+                failures[name] -= 1
+                raise IOError("Cannot load {}".format(name))
+            return name
+
+        print("\nStarting Eviction Test ...")
+        pool = ModelPool(root, loader, max_models=2, max_bytes=1 << 20)
+        assert pool.get('a') == 'a' and pool.get('b') == 'b'
+        # Using `a` makes `b` the least recently used model
+        assert pool.get('a') == 'a'
+        assert pool.get('c') == 'c'
+        assert list(pool.models) == ['a', 'c'], list(pool.models)
+        assert pool.stats()['evictions'] == 1 and pool.size == 2000, pool.stats()
+        # The byte cap evicts down to the model just loaded
+        forgotten = []
+        pool = ModelPool(root, loader, max_models=10, max_bytes=1500, forget_fn=forgotten.append)
+        pool.get('a')
+        pool.get('b')
+        assert list(pool.models) == ['b'], list(pool.models)
+        # Loaded and evicted models are forgotten, e.g. by the prediction cache
+        assert forgotten == ['a', 'b', 'a'], forgotten
+        print("Least recently used models evicted: {}".format(pool.stats()))
+
+        print("\nStarting Failed Load Test ...")
+        try:
+            pool.get('broken')
+        except IOError:
+            pass
+        else:
+            raise AssertionError("The failed load was not raised")
+        assert 'broken' not in pool.models and not pool.loading, pool.loading
+        assert pool.get('broken') == 'broken'
+        for name, error in [('missing', ModelNotFoundError), ('../a', ValueError)]:
+            try:
+                pool.get(name)
+            except error:
+                pass
+            else:
+                raise AssertionError("Model '{}' did not raise {}".format(name, error.__name__))
+        assert not pool.loading, pool.loading
+        print("Failed, missing and invalid models leave no loading entry behind")
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+from sklearn import preprocessing
+
+# Import the training and serving modules from the `model` folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model'))
+import model
+from numpy_model import NumpyModel
+
+validate_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input/data/training/validate.csv')
+
+
+def latency(predict, payload, repeats=1000):
+    """
+    Description:
+    -----------
+    Measures the mean latency of a prediction function.
+
+    :predict: (function) Prediction function under test.
+    :payload: (NumPy Array) Observations to score on every call.
+    :repeats: (int) Number of calls to average over.
+
+    :returns: (float) Mean latency in microseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predict(payload)
+    return 1e6 * (time.perf_counter() - start) / repeats
+
+
+def main():
+    # Untrained network with the same layout as the training job
+    keras_model = model.build_model(layers=2, dense_layer=64)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model.npz')
+        model.export_numpy(keras_model, path)
+        numpy_model = NumpyModel.load(path)
+
+    payload = np.loadtxt(validate_path, delimiter=',')[:, 1:]
+    payload = preprocessing.normalize(payload).astype(np.float32)
+
+    print("\nStarting Parity Test ...")
+    expected = keras_model.predict(payload, verbose=0)
+    actual = numpy_model.predict(payload)
+    np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-5)
+    print("NumPy and Keras predictions match for {} observations".format(len(payload)))
+
+    print("\nStarting Latency Test ...")
+    row = payload[:1]
+    print("Keras single row latency: %.1f us" % latency(lambda x: keras_model.predict(x, verbose=0), row, repeats=20))
+    print("NumPy single row latency: %.1f us" % latency(numpy_model.predict, row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+# Import the training module from the `model` folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model'))
+import model
+
+train_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input/data/training/train.csv')
+
+
+def feed(fifo_path, file_path):
+    """
+    Description:
+    -----------
+    Streams a file into a named pipe, the way SageMaker feeds a Pipe mode channel.
+
+    :fifo_path: (str) Path of the FIFO.
+    :file_path: (str) File to stream.
+    """
+    # Opening the FIFO for writing blocks until the trainer opens it for reading
+    with open(fifo_path, 'wb') as fifo, open(file_path, 'rb') as f:
+        shutil.copyfileobj(f, fifo)
+
+
+def main():
+    expected = np.loadtxt(train_path, delimiter=',')
+    tmp = tempfile.mkdtemp()
+    try:
+        model.input_path = tmp
+        fifo_path = os.path.join(tmp, 'training_0')
+        os.mkfifo(fifo_path)
+        # A small chunk size splits records across reads
+        model.pipe_chunk_bytes = 1000
+        feeder = threading.Thread(target=feed, args=(fifo_path, train_path))
+        feeder.start()
+
+        print("\nStarting Pipe Mode Test ...")
+        actual = model.read_pipe('training')
+        feeder.join()
+    finally:
+        shutil.rmtree(tmp)
+
+    np.testing.assert_allclose(actual, expected)
+    print("Pipe mode read {} records matching File mode".format(len(actual)))
+
+    # Ragged records are rejected, even when their values add up to whole rows
+    try:
+        model.parse_csv_lines([b'1,2,3', b'4,5', b'6,7,8,9'])
+    except ValueError:
+        print("Ragged records rejected")
+    else:
+        raise AssertionError("Ragged records were not rejected")
+
+
+if __name__ == "__main__":
+    main()
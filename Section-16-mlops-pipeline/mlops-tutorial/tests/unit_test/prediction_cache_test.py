@@ -0,0 +1,77 @@
+import os
+import sys
+import numpy as np
+
+# Import the serving module from the `model` folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model'))
+from app import PredictionCache
+
+
+def double(data):
+    return data[:, :1] * 2
+
+
+def main():
+    print("\nStarting LRU Eviction Test ...")
+    keys = PredictionCache.keys(np.arange(12, dtype=np.float32).reshape(4, 3))
+    result = np.zeros(1, dtype=np.float32)
+    entry_size = len(keys[0]) + result.nbytes + PredictionCache.entry_overhead
+    cache = PredictionCache(3 * entry_size, ttl=0)
+    for key in keys[:3]:
+        cache.put(key, result, now=0)
+    # Reading the oldest entry makes the second one the least recently used
+    assert cache.get(keys[0], now=0) is not None
+    cache.put(keys[3], result, now=0)
+    assert cache.get(keys[1], now=0) is None
+    assert all(cache.get(key, now=0) is not None for key in [keys[0], keys[2], keys[3]])
+    assert cache.stats()['evictions'] == 1 and cache.size == 3 * entry_size, cache.stats()
+    print("Least recently used entry evicted at {} bytes".format(cache.size))
+
+    print("\nStarting TTL Expiry Test ...")
+    cache = PredictionCache(1 << 20, ttl=10)
+    cache.put(keys[0], result, now=0)
+    assert cache.get(keys[0], now=10) is not None
+    assert cache.get(keys[0], now=10.5) is None
+    assert cache.stats()['entries'] == 0 and cache.size == 0, cache.stats()
+    print("Entry expired after {} seconds".format(cache.ttl))
+
+    print("\nStarting Hit and Miss Test ...")
+    cache = PredictionCache(1 << 20, ttl=0)
+    data = np.array([[1, 2], [1, 2], [3, 4]], dtype=np.float32)
+    np.testing.assert_array_equal(cache.predict(data, double), double(data))
+    np.testing.assert_array_equal(cache.predict(data, double), double(data))
+    # Both counted per row, duplicate rows of a request share one entry
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses']) == (2, 3, 3), stats
+    assert cache.predict(data[:0], double).shape == (0, 1)
+    print("Hits and misses counted per row: {}".format(stats))
+
+    print("\nStarting Stale Put Test ...")
+    cache = PredictionCache(1 << 20, ttl=0)
+    def swap_while_scoring(rows):
+        # The model is swapped while the request is scored
+        cache.clear()
+        return double(rows)
+    np.testing.assert_array_equal(cache.predict(data, swap_while_scoring), double(data))
+    assert cache.stats()['entries'] == 0, cache.stats()
+    cache.predict(data, double)
+    assert cache.stats()['entries'] == 2, cache.stats()
+    print("Predictions of a swapped model answered but not cached")
+
+    print("\nStarting Namespace Test ...")
+    cache = PredictionCache(1 << 20, ttl=0)
+    cache.predict(data, double, 'a')
+    cache.predict(data, double, 'b')
+    def reload_while_scoring(rows):
+        # The model pool evicts and reloads `a` while the request is scored
+        cache.clear_namespace('a')
+        return double(rows)
+    cache.predict(data + 1, reload_while_scoring, 'a')
+    assert cache.stats()['entries'] == 2, cache.stats()
+    assert cache.predict(data, lambda rows: -double(rows), 'b')[0, 0] == double(data)[0, 0]
+    np.testing.assert_array_equal(cache.predict(data, lambda rows: -double(rows), 'a'), -double(data))
+    print("Predictions of a reloaded model dropped, other models kept")
+
+
+if __name__ == "__main__":
+    main()
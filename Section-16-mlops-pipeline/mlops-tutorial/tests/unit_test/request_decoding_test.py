@@ -0,0 +1,72 @@
+import io
+import os
+import sys
+import numpy as np
+
+# Import the serving module from the `model` folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model'))
+from app import csv_to_numpy, npy_to_numpy, octet_stream_to_numpy
+
+
+def npy(array):
+    body = io.BytesIO()
+    np.save(body, array)
+    return body.getvalue()
+
+
+def assert_rejected(decoder, body, params=None):
+    # A ValueError is answered with a 400 by the invocation handlers
+    try:
+        decoder(body, params)
+    except ValueError:
+        return
+    raise AssertionError("{} accepted a malformed body".format(decoder.__name__))
+
+
+def main():
+    print("\nStarting CSV Decoding Test ...")
+    expected = np.array([[1, 2, 3], [4, 5, 6]], dtype=np.float64)
+    # A trailing comma ends a record
+    for body in [b'1,2,3\n4,5,6\n', b'1,2,3,\n4,5,6,\n', b'1,2,3,\r\n4,5,6']:
+        np.testing.assert_array_equal(csv_to_numpy(body), expected)
+    malformed = [b'1,2,3\n4,5\n', b'1,2\n3,4,5\n', b'1,,3\n', b'1,a,3\n', b'1,2,3,,\n', b'\n\n']
+    for body in malformed:
+        assert_rejected(csv_to_numpy, body)
+    print("Decoded CSV records, rejected {} malformed bodies".format(len(malformed)))
+
+    print("\nStarting .npy Decoding Test ...")
+    data = np.arange(6, dtype=np.float32).reshape(2, 3)
+    for array in [data, data.astype(np.int64), data.astype(bool), np.asfortranarray(data)]:
+        np.testing.assert_array_equal(npy_to_numpy(npy(array)), array)
+    malformed = [
+        npy(data[0]), # 1-D
+        npy(data[None]), # 3-D
+        npy(data[:0]), # no records
+        npy(data.astype(np.complex64)),
+        npy(np.array([['a', 'b']])),
+        npy(np.array([[1, None]], dtype=object)),
+        npy(data)[:-4], # truncated
+        b'not an npy body',
+        b''
+    ]
+    for body in malformed:
+        assert_rejected(npy_to_numpy, body)
+    print("Decoded 2-D numeric arrays, rejected {} malformed bodies".format(len(malformed)))
+
+    print("\nStarting Octet-Stream Decoding Test ...")
+    body = data.astype('<f4').tobytes()
+    np.testing.assert_array_equal(octet_stream_to_numpy(body, {'features': '3'}), data)
+    malformed = [
+        (body, {'features': '4'}), # not a whole number of records
+        (body[:-1], {'features': '3'}),
+        (b'', {'features': '3'}),
+        (body, {'features': '0'}),
+        (body, {'features': 'three'})
+    ]
+    for body, params in malformed:
+        assert_rejected(octet_stream_to_numpy, body, params)
+    print("Decoded packed float32 records, rejected {} malformed bodies".format(len(malformed)))
+
+
+if __name__ == "__main__":
+    main()
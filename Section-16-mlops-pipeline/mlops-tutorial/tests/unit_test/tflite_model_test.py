@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+import numpy as np
+from sklearn import preprocessing
+
+# Import the training and serving modules from the `model` folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'model'))
+import model
+from tflite_model import TFLiteModel
+
+validate_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'input/data/training/validate.csv')
+
+
+def latency(predict, payload, repeats=1000):
+    # Mean latency of a prediction function in microseconds
+    start = time.perf_counter()
+    for _ in range(repeats):
+        predict(payload)
+    return 1e6 * (time.perf_counter() - start) / repeats
+
+
+def main():
+    # Untrained network with the same layout as the training job
+    keras_model = model.build_model(layers=2, dense_layer=64)
+    payload = np.loadtxt(validate_path, delimiter=',')[:, 1:]
+    payload = preprocessing.normalize(payload).astype(np.float32)
+    expected = keras_model.predict(payload, verbose=0)
+
+    for mode, tolerance in [('float16', 1e-2), ('int8', 1e-1)]:
+        print("\nStarting {} Parity Test ...".format(mode))
+        tflite_model = TFLiteModel.from_content(model.export_tflite(keras_model, mode, payload))
+        # Alternate batch sizes, the input tensor is resized for every change
+        for rows in [len(payload), 1, 7, len(payload)]:
+            actual = tflite_model.predict(payload[:rows])
+            assert actual.shape == expected[:rows].shape, actual.shape
+            # Quantization error, relative to the scale of the predictions
+            error = np.mean(np.abs(actual - expected[:rows])) / np.mean(np.abs(expected))
+            assert error < tolerance, "{} error of {:.4f}".format(mode, error)
+        print("{} and Keras predictions match for {} observations".format(mode, len(payload)))
+        print("{} single row latency: {:.1f} us".format(mode, latency(tflite_model.predict, payload[:1])))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from urllib import request
+import numpy as np
+
+base_url = 'http://localhost:8080'
+headers = {"Content-type": "text/csv"}
+
+# Toy request payload from the unit test: a single `abalone` observation
+payload = "6.550000000000000266e-01,5.200000000000000178e-01,1.900000000000000022e-01,\
+1.454499999999999904e+00,5.999999999999999778e-01,3.865000000000000102e-01,\
+3.829999999999999516e-01,1.000000000000000000e+00,0.000000000000000000e+00,0.000000000000000000e+00".encode('utf-8')
+
+
+def wait_for(call, timeout):
+    """
+    Description:
+    ------------
+    Retries a request until it returns HTTP 200.
+
+    :call: (function) Function issuing the request and returning the response code.
+    :timeout: (float) Seconds to wait before giving up.
+
+    :returns: (float) Time at which the request first succeeded.
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if call() == 200:
+                return time.perf_counter()
+        except Exception:
+            pass
+        time.sleep(0.05)
+    raise Exception("Container did not respond within {} seconds".format(timeout))
+
+
+def start_container(image, model_dir, env, cpus=None):
+    """
+    Description:
+    ------------
+    Starts the serving container in the background, listening on port 8080.
+
+    :image: (str) Docker image of the serving container.
+    :model_dir: (str) Local folder with the model artifacts, mounted as `/opt/ml/model`.
+    :env: (list) Environment variables as `KEY=VALUE` strings.
+    :cpus: (float) CPU quota of the container, None for no limit.
+
+    :returns: (str) The container ID.
+    """
+    command = ['docker', 'run', '-d', '--rm', '-p', '8080:8080', '-v', '{}:/opt/ml/model'.format(os.path.abspath(model_dir))]
+    if cpus is not None:
+        command += ['--cpus', str(cpus)]
+    for variable in env:
+        command += ['-e', variable]
+    return subprocess.check_output(command + [image, 'serve']).decode('utf-8').strip()
+
+
+def stop_container(container):
+    subprocess.call(['docker', 'stop', container], stdout=subprocess.DEVNULL)
+
+
+def run_once(image, model_dir, env, timeout):
+    """
+    Description:
+    ------------
+    Starts the serving container and measures the time to the first healthy `/ping`
+    and to the first successful prediction.
+
+    :image: (str) Docker image of the serving container.
+    :model_dir: (str) Local folder with the model artifacts, mounted as `/opt/ml/model`.
+    :env: (list) Environment variables as `KEY=VALUE` strings.
+    :timeout: (float) Seconds to wait for the container to respond.
+
+    :returns: (dict) Seconds to first `/ping` and to first prediction.
+    """
+    start = time.perf_counter()
+    container = start_container(image, model_dir, env)
+    try:
+        ping = wait_for(lambda: request.urlopen("%s/ping" % base_url).getcode(), timeout)
+        invoke = request.Request("%s/invocations" % base_url, data=payload, headers=headers)
+        prediction = wait_for(lambda: request.urlopen(invoke).getcode(), timeout)
+    finally:
+        stop_container(container)
+    return {'ping': ping - start, 'prediction': prediction - start}
+
+
+def main(args):
+    results = []
+    for run in range(args.runs):
+        result = run_once(args.image, args.model_dir, args.env, args.timeout)
+        print("Run {}: first ping {:.2f}s, first prediction {:.2f}s".format(run + 1, result['ping'], result['prediction']))
+        results.append(result)
+
+    report = {'image': args.image, 'env': args.env, 'runs': results}
+    for key in ['ping', 'prediction']:
+        values = np.array([result[key] for result in results])
+        report[key] = {'median': float(np.median(values)), 'min': float(values.min()), 'max': float(values.max())}
+    print(json.dumps(report, indent=4))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    # Fail the build when the median cold start regresses past the thresholds
+    failed = False
+    for key, threshold in [('ping', args.max_ping), ('prediction', args.max_prediction)]:
+        if threshold is not None and report[key]['median'] > threshold:
+            print("Median time to first {} {:.2f}s exceeds {:.2f}s".format(key, report[key]['median'], threshold))
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold start benchmark for the abalone serving container.")
+    parser.add_argument("--image", type=str, default="abalone:latest")
+    parser.add_argument("--model-dir", type=str, required=True)
+    parser.add_argument("--env", type=str, action="append", default=[], help="Container environment variable as KEY=VALUE")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--max-ping", type=float, default=None, help="Maximum median seconds to the first healthy /ping")
+    parser.add_argument("--max-prediction", type=float, default=None, help="Maximum median seconds to the first prediction")
+    parser.add_argument("--report", type=str, default=None, help="Path of the JSON report")
+    main(parser.parse_args())
@@ -1,21 +1,23 @@
+import argparse
+import asyncio
+import collections
 import threading
 import boto3
 import json
 import time
 import math
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http import client
+from urllib.parse import urlparse
 from botocore.exceptions import ClientError
-from multiprocessing.pool import ThreadPool
-from datetime import datetime 
 import numpy as np
 import pandas as pd
 from botocore.config import Config
 
 # Global Variables
 config = Config(retries = {'max_attempts': 10, 'mode': 'adaptive'})
-sagemaker = boto3.client("sagemaker-runtime", config=config)
-codepipeline = boto3.client('codepipeline')
-s3 = boto3.client('s3')
 pipeline_name = 'abalone-pipeline'
 endpoint_name = 'abalone-prd-endpoint'
 pipeline_bucket = '<PipelineBucket>'
@@ -27,13 +29,14 @@ def get_env_jobid(env='prd'):
     """
     Description:
     ------------
-    Function to return the most up to date `pipelineExecitionId` based on the 
+    Function to return the most up to date `pipelineExecitionId` based on the
     environment input.
-    
+
     :env: (str) Specifies either 'dev' or 'prd' environments.
-    
+
     :returns: Latest CodePipeline Execution ID
     """
+    codepipeline = boto3.client('codepipeline')
     try:
         response = codepipeline.get_pipeline_state(name=pipeline_name)
         for stage in response['stageStates']:
@@ -47,64 +50,275 @@ def get_env_jobid(env='prd'):
         raise Exception(error_message)
 
 
-# Invoke SageMaker endpoint
-def predict(payload):
+class RequestError(Exception):
     """
     Description:
     ------------
-    Invokes SageMaker endpoint with NumPy payload.
+    Failed inference request, `kind` groups the failures in the report,
+    e.g. 'http_503' or 'ThrottlingException'.
+    """
+    def __init__(self, kind, message=''):
+        super().__init__(message or kind)
+        self.kind = kind
+
 
-    :payload: (NumPy Array) Abalone datset observations as a NumPy Array.
-    
-    :returns: response (str) Python list containing the predicted age.
+class SageMakerEndpoint(object):
     """
-    payload = ",".join(map(str, payload))
-    try:
-        request = sagemaker.invoke_endpoint(
-            EndpointName=endpoint_name,
-            ContentType = "text/csv",
-            Body=payload
-        )
-    except ClientError as e:
-        error_message = e.request["Error"]["Message"]
-        print(error_message)
-        raise Exception(error_message)
-    return request['Body'].read().decode('utf-8').rstrip('\n')
+    Description:
+    ------------
+    Invokes a SageMaker endpoint with CSV payloads.
+
+    :name: (str) SageMaker endpoint name.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.runtime = boto3.client("sagemaker-runtime", config=config)
+
+    def invoke(self, body):
+        try:
+            response = self.runtime.invoke_endpoint(EndpointName=self.name, ContentType="text/csv", Body=body)
+        except ClientError as e:
+            raise RequestError(e.response["Error"]["Code"], e.response["Error"]["Message"])
+        return response['Body'].read()
+
+
+class HttpEndpoint(object):
+    """
+    Description:
+    ------------
+    Posts CSV payloads to the `/invocations` route of a serving container or any local
+    stand-in server, with one keep-alive connection per thread.
+
+    :url: (str) Base URL, e.g. 'http://localhost:8080' or 'https://host'.
+    """
+    def __init__(self, url):
+        url = urlparse(url)
+        self.https = url.scheme == 'https'
+        self.host, self.port = url.hostname, url.port or (443 if self.https else 80)
+        self.path = url.path.rstrip('/') + '/invocations'
+        self.connections = threading.local()
+
+    def invoke(self, body):
+        connection = getattr(self.connections, 'connection', None)
+        if connection is None:
+            connection_class = client.HTTPSConnection if self.https else client.HTTPConnection
+            connection = self.connections.connection = connection_class(self.host, self.port)
+        try:
+            connection.request('POST', self.path, body=body, headers={"Content-type": "text/csv"})
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, client.HTTPException):
+            connection.close()
+            self.connections.connection = None
+            raise
+        if response.status != 200:
+            raise RequestError('http_{}'.format(response.status), data.decode('utf-8', 'replace'))
+        return data
+
+
+def endpoint_from_spec(spec):
+    # 'http(s)://host:port' for an HTTP server, 'sagemaker:<name>' or a bare name for SageMaker
+    if spec.startswith(('http://', 'https://')):
+        return HttpEndpoint(spec)
+    return SageMakerEndpoint(spec.split(':', 1)[1] if spec.startswith('sagemaker:') else spec)
+
+
+class LatencyHistogram(object):
+    """
+    Description:
+    ------------
+    HDR-style histogram of latencies: log-spaced buckets with a bounded relative
+    error, so that memory is constant however many requests are recorded and tail
+    percentiles stay accurate.
+
+    :lowest: (float) Smallest distinguishable latency in seconds.
+    :highest: (float) Largest trackable latency in seconds, larger values are clamped.
+    :precision: (float) Relative width of a bucket, e.g. 0.01 for 1%.
+    """
+    def __init__(self, lowest=1e-5, highest=600, precision=0.01):
+        self.lowest = lowest
+        self.log_base = math.log1p(precision)
+        self.counts = np.zeros(self.index(highest) + 1, dtype=np.int64)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def index(self, value):
+        return int(math.log(max(value, self.lowest) / self.lowest) / self.log_base)
+
+    def record(self, value):
+        self.counts[min(self.index(value), len(self.counts) - 1)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percentile):
+        if self.total == 0:
+            return None
+        rank = max(1, math.ceil(self.total * percentile / 100))
+        index = int(np.searchsorted(np.cumsum(self.counts), rank))
+        # Upper bound of the bucket, never above the largest recorded value
+        return min(self.lowest * math.exp((index + 1) * self.log_base), self.max)
+
+    def summary(self, percentiles=(50, 90, 99, 99.9, 99.99)):
+        summary = {'count': self.total, 'mean_ms': 1000 * self.sum / self.total if self.total else None,
+                   'max_ms': 1000 * self.max if self.total else None}
+        for percentile in percentiles:
+            value = self.percentile(percentile)
+            summary['p{:g}_ms'.format(percentile)] = None if value is None else 1000 * value
+        return summary
+
+
+def parse_stage(spec):
+    # 'duration:rps' holds a constant rate, 'duration:start-end' ramps it linearly
+    duration, _, rate = spec.partition(':')
+    start, _, end = rate.partition('-')
+    return float(duration), float(start), float(end or start)
+
+
+def schedule(stages):
+    """
+    Description:
+    ------------
+    Yields the intended send time of every request, in seconds from the start of
+    the test, following the arrival rate of every stage.
+
+    :stages: (list) (duration, start rps, end rps) tuples.
+
+    :returns: (Generator) Intended send offsets.
+    """
+    offset = 0.0
+    for duration, start, end in stages:
+        elapsed = 0.0
+        while elapsed < duration:
+            rate = start + (end - start) * elapsed / duration
+            if rate <= 0:
+                # Idle until the ramp reaches a positive rate
+                elapsed += 0.01
+                continue
+            yield offset + elapsed
+            elapsed += 1.0 / rate
+        offset += duration
+
+
+def payloads(dataset):
+    # Streams the observations as CSV rows, reshuffled on every pass over the data
+    while True:
+        for index in np.random.permutation(len(dataset)):
+            yield ",".join(map(str, dataset[index])).encode('utf-8')
+
 
 # Execute inference test
-def run_test(max_threads, max_requests, dataset):
+async def run_test(endpoint, dataset, stages, max_in_flight):
     """
     Description:
     ------------
-    Executes the inference testing.
+    Open-loop load test: requests are sent at the scheduled arrival rate whether or
+    not earlier requests completed, and each latency is measured from the intended
+    send time, which corrects for coordinated omission. Requests that would exceed
+    `max_in_flight` are dropped: they are counted as errors, and the drop rate is
+    reported next to the percentiles, since the slowest requests are the ones missing.
 
-    :max_threads: (int) Integer specifying the number of concurrent threads.
-    :max_requests: (int) Integer specifying the the number of inference requests per thread.
+    :endpoint: (object) Endpoint with a blocking `invoke(body)` method.
     :dataset: (NumPy) Array of test data.
+    :stages: (list) (duration, start rps, end rps) tuples.
+    :max_in_flight: (int) Maximum number of outstanding requests.
+
+    :returns: (dict) Machine-readable report.
     """
-    start_time = datetime.now() 
-    num_batches = math.ceil(max_requests / len(dataset))
-    requests = []
-    for i in range(num_batches):
-        batch = dataset.copy()
-        np.random.shuffle(batch)
-        requests += batch.tolist()
-    pool = ThreadPool(max_threads)
-    result = pool.map(predict, requests)
-    pool.close()
-    pool.join()
-    elapsed_time = datetime.now() - start_time
-    print("Time elapsed (hh:mm:ss.ms) {}".format(elapsed_time))
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    corrected = LatencyHistogram()
+    service = LatencyHistogram()
+    errors = collections.Counter()
+    counts = collections.Counter()
+    tasks = set()
+    rows = payloads(dataset)
+
+    async def fire(intended, body):
+        sent = time.perf_counter()
+        try:
+            await loop.run_in_executor(executor, endpoint.invoke, body)
+        except RequestError as e:
+            errors[e.kind] += 1
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        else:
+            done = time.perf_counter()
+            corrected.record(done - intended)
+            service.record(done - sent)
+            counts['completed'] += 1
+
+    start = time.perf_counter()
+    for offset in schedule(stages):
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(tasks) >= max_in_flight:
+            # Never sent, so no latency, but an error of the server's making
+            counts['dropped'] += 1
+            errors['dropped'] += 1
+            continue
+        counts['sent'] += 1
+        task = asyncio.ensure_future(fire(start + offset, next(rows)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+    scheduled = counts['sent'] + counts['dropped']
+
+    return {
+        'stages': [{'duration': duration, 'start_rps': rate_start, 'end_rps': rate_end} for duration, rate_start, rate_end in stages],
+        'elapsed_s': elapsed,
+        'sent': counts['sent'],
+        'completed': counts['completed'],
+        'dropped': counts['dropped'],
+        'achieved_rps': counts['completed'] / elapsed,
+        'errors': dict(errors),
+        # Share of the scheduled requests dropped, whose latency the percentiles leave out
+        'drop_rate': counts['dropped'] / scheduled if scheduled else 0.0,
+        # Latency from the intended send time, including any wait behind slow requests
+        'latency': corrected.summary(),
+        # Latency from the actual send time, what a closed-loop client would report
+        'service_time': service.summary()
+    }
+
 
 if __name__ == "__main__":
-    # Get latest CodePipeline Execition ID
-    job_id=get_env_jobid()
+    parser = argparse.ArgumentParser(description="Open-loop load test of the abalone endpoint.")
+    parser.add_argument("--endpoint", type=str, default="sagemaker:%s" % endpoint_name,
+                        help="'sagemaker:<endpoint name>', or the URL of a serving container or local stand-in, e.g. http://localhost:8080")
+    parser.add_argument("--data", type=str, default=None,
+                        help="Local CSV test data with the label in the first column, downloaded from the pipeline bucket by default")
+    parser.add_argument("--stage", type=str, action="append", default=None,
+                        help="Load stage as 'seconds:rps' or 'seconds:start_rps-end_rps' for a ramp, repeat for several stages")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Outstanding requests before new ones are dropped")
+    parser.add_argument("--max-drop-rate", type=float, default=0.01,
+                        help="Share of dropped requests above which the run fails, as the percentiles would be too optimistic")
+    parser.add_argument("--report", type=str, default=None, help="Path of the JSON report")
+    args = parser.parse_args()
+
+    if args.data is None:
+        # Get latest CodePipeline Execition ID
+        job_id=get_env_jobid()
 
-    # Download test dataset
-    s3.download_file(pipeline_bucket, os.path.join(job_id, obj), 'test.csv')
-    test_data = pd.read_csv('test.csv', header=None)
+        # Download test dataset
+        boto3.client('s3').download_file(pipeline_bucket, os.path.join(job_id, obj), 'test.csv')
+        args.data = 'test.csv'
+    test_data = pd.read_csv(args.data, header=None)
     test_data = test_data.drop(test_data.columns[0], axis=1)
     dataset = test_data.to_numpy()
+    stages = [parse_stage(stage) for stage in (args.stage or ['60:10-100', '300:100'])]
 
     print("Starting test ...")
-    run_test(150, 1000000, dataset)
\ No newline at end of file
+    report = asyncio.run(run_test(endpoint_from_spec(args.endpoint), dataset, stages, args.max_in_flight))
+    print(json.dumps(report, indent=4))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
+    if report['drop_rate'] > args.max_drop_rate:
+        print("Failed: {:.2%} of the requests were dropped at --max-in-flight {}, above --max-drop-rate {:.2%}.".format(
+            report['drop_rate'], args.max_in_flight, args.max_drop_rate), file=sys.stderr)
+        sys.exit(1)
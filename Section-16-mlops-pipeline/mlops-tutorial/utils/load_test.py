@@ -0,0 +1,175 @@
+import argparse
+import importlib
+import json
+import os
+import sys
+import threading
+from urllib import request
+from werkzeug.serving import WSGIRequestHandler, make_server
+from cold_start import start_container, stop_container, wait_for
+from serving_benchmark import drive
+
+# Defaults: the abalone serving app and the features of the validation data set
+utils_path = os.path.dirname(os.path.abspath(__file__))
+default_app = os.path.join(utils_path, '..', 'model', 'app.py')
+default_payload = os.path.join(utils_path, '..', 'tests', 'unit_test', 'input', 'data', 'training', 'validate.csv')
+percentiles = (50, 95, 99, 99.9)
+
+
+class RequestHandler(WSGIRequestHandler):
+    # Keep-alive connections like nginx in the container, without a log line per request
+    protocol_version = 'HTTP/1.1'
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def load_rows(path, label_column):
+    """
+    Description:
+    ------------
+    Reads the request records from a CSV file.
+
+    :path: (str) CSV file with one observation per line.
+    :label_column: (bool) Drop the first column, which holds the label.
+
+    :returns: (list) Bytes encoded records.
+    """
+    with open(path, 'rb') as f:
+        rows = [line.strip() for line in f if line.strip()]
+    if label_column:
+        rows = [row.split(b',', 1)[1] for row in rows]
+    return rows
+
+
+def payload(rows, size):
+    # `size` records per request, cycling through the file
+    return b"\n".join(rows[index % len(rows)] for index in range(size))
+
+
+def start_in_process(app_path, model_dir, env):
+    """
+    Description:
+    ------------
+    Imports a serving module, points it at the model artifacts and serves its WSGI app
+    on a threaded server in this process, on a free local port.
+
+    :app_path: (str) Serving module exposing `app` and `model_path`, e.g. `model/app.py`
+        or the decision tree container's `predictor.py`.
+    :model_dir: (str) Local folder with the model artifacts.
+    :env: (list) Environment variables as `KEY=VALUE` strings, set before the import.
+
+    :returns: (werkzeug.serving.BaseWSGIServer) The running server.
+    """
+    for variable in env:
+        key, _, value = variable.partition('=')
+        os.environ[key] = value
+    sys.path.insert(0, os.path.dirname(os.path.abspath(app_path)))
+    module = importlib.import_module(os.path.splitext(os.path.basename(app_path))[0])
+    module.model_path = os.path.abspath(model_dir)
+    server = make_server('localhost', 0, module.app, threaded=True, request_handler=RequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def regressions(report, baseline, tolerance):
+    """
+    Description:
+    ------------
+    Compares every run with the baseline run of the same payload size and concurrency.
+
+    :report: (dict) Results of this run.
+    :baseline: (dict) Stored results of a previous run.
+    :tolerance: (float) Allowed relative drop in throughput and rise in latency.
+
+    :returns: (list) Descriptions of the regressions.
+    """
+    expected = {(result['rows'], result['concurrency']): result for result in baseline['results']}
+    failures = []
+    for result in report['results']:
+        reference = expected.get((result['rows'], result['concurrency']))
+        if reference is None:
+            continue
+        name = "rows={} concurrency={}".format(result['rows'], result['concurrency'])
+        if result['throughput'] < reference['throughput'] * (1 - tolerance):
+            failures.append("{}: throughput {:.1f}/s below baseline {:.1f}/s".format(
+                name, result['throughput'], reference['throughput']))
+        for percentile in percentiles:
+            key = 'p{:g}_ms'.format(percentile)
+            if result.get(key) is not None and reference.get(key) is not None and result[key] > reference[key] * (1 + tolerance):
+                failures.append("{}: {} {:.2f} above baseline {:.2f}".format(name, key, result[key], reference[key]))
+    return failures
+
+
+def main(args):
+    rows = load_rows(args.payload, not args.no_label_column)
+    if args.target == 'container':
+        host, port = 'localhost', 8080
+        container = start_container(args.image, args.model_dir, args.env, args.cpus)
+    else:
+        server = start_in_process(args.app, args.model_dir, args.env)
+        host, port = 'localhost', server.server_port
+    try:
+        wait_for(lambda: request.urlopen("http://{}:{}/ping".format(host, port)).getcode(), args.timeout)
+        report = {'target': args.target, 'duration': args.duration, 'results': []}
+        for size in args.rows:
+            body = payload(rows, size)
+            # Warm up the model and the connections before measuring
+            drive(max(args.concurrency), min(2, args.duration), body, host, port)
+            for concurrency in args.concurrency:
+                result = drive(concurrency, args.duration, body, host, port, percentiles)
+                result['rows'] = size
+                report['results'].append(result)
+    finally:
+        if args.target == 'container':
+            stop_container(container)
+        else:
+            server.shutdown()
+
+    print("{:>6} {:>11} {:>12} {:>9} {:>9} {:>9} {:>9} {:>7}".format(
+        'rows', 'concurrency', 'requests/s', 'p50 ms', 'p95 ms', 'p99 ms', 'p99.9 ms', 'errors'))
+    for result in report['results']:
+        print("{:>6} {:>11} {:>12.1f} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f} {:>7}".format(
+            result['rows'], result['concurrency'], result['throughput'], *[result['p{:g}_ms'.format(p)] or 0 for p in percentiles],
+            result['errors']))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    # Fail the build on errors, or when the results regress past the stored baseline
+    failures = ["rows={} concurrency={}: {} errors".format(result['rows'], result['concurrency'], result['errors'])
+                for result in report['results'] if result['errors']]
+    if args.baseline is not None:
+        if args.save_baseline:
+            with open(args.baseline, 'w') as f:
+                json.dump(report, f, indent=4)
+            print("Saved the baseline to {}".format(args.baseline))
+        else:
+            with open(args.baseline) as f:
+                failures += regressions(report, json.load(f), args.tolerance)
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local load test of the serving app against local model artifacts.")
+    parser.add_argument("--target", type=str, choices=["in-process", "container"], default="in-process",
+                        help="Serve the WSGI app in this process, or run the serving container")
+    parser.add_argument("--model-dir", type=str, required=True, help="Local folder with the model artifacts")
+    parser.add_argument("--app", type=str, default=default_app, help="Serving module of the in-process target")
+    parser.add_argument("--image", type=str, default="abalone:latest", help="Docker image of the container target")
+    parser.add_argument("--cpus", type=float, default=None, help="CPU quota of the container target")
+    parser.add_argument("--env", type=str, action="append", default=[], help="Environment variable as KEY=VALUE")
+    parser.add_argument("--payload", type=str, default=default_payload, help="CSV file of the request records")
+    parser.add_argument("--no-label-column", action="store_true", help="The payload file has no label in the first column")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 100], help="Records per request")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per payload size and concurrency level")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--report", type=str, default=None, help="Path of the JSON report")
+    parser.add_argument("--baseline", type=str, default=None, help="Path of the JSON baseline to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline instead of comparing")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression against the baseline")
+    main(parser.parse_args())
@@ -0,0 +1,106 @@
+import argparse
+import json
+import threading
+import time
+from http import client
+from urllib import request
+import numpy as np
+from cold_start import base_url, payload, start_container, stop_container, wait_for
+
+headers = {"Content-type": "text/csv"}
+
+
+def drive(concurrency, duration, body, host='localhost', port=8080, percentiles=(50, 99)):
+    """
+    Description:
+    ------------
+    Sends back-to-back requests from `concurrency` closed-loop clients, each on its own
+    keep-alive connection, for `duration` seconds.
+
+    :concurrency: (int) Number of concurrent clients.
+    :duration: (float) Seconds to run the test.
+    :body: (Bytes) Request payload.
+    :host: (str) Host of the inference server.
+    :port: (int) Port of the inference server.
+    :percentiles: (tuple) Latency percentiles to report.
+
+    :returns: (dict) Throughput, latency percentiles and error count.
+    """
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        connection = client.HTTPConnection(host, port)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                connection.request('POST', '/invocations', body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise Exception(response.status)
+                latencies[index].append(time.perf_counter() - start)
+            except Exception:
+                errors[index] += 1
+                connection.close()
+                connection = client.HTTPConnection(host, port)
+        connection.close()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    values = np.concatenate([np.array(values) for values in latencies]) * 1000
+    result = {'concurrency': concurrency, 'requests': int(values.size), 'errors': sum(errors),
+              'throughput': values.size / elapsed}
+    for percentile in percentiles:
+        # e.g. 'p99_ms', or 'p99.9_ms'
+        result['p{:g}_ms'.format(percentile)] = float(np.percentile(values, percentile)) if values.size else None
+    return result
+
+
+def main(args):
+    body = b"\n".join([payload] * args.rows)
+    report = {'rows': args.rows, 'duration': args.duration, 'modes': {}}
+    for cpus in args.cpus:
+        for mode in args.modes:
+            # e.g. 'wsgi' without a CPU quota, 'wsgi@2' with `--cpus 2`
+            name = mode if cpus is None else '{}@{:g}'.format(mode, cpus)
+            container = start_container(args.image, args.model_dir, args.env + ['MODEL_SERVER_MODE={}'.format(mode)], cpus)
+            try:
+                wait_for(lambda: request.urlopen("%s/ping" % base_url).getcode(), args.timeout)
+                # Warm up every worker before measuring
+                drive(max(args.concurrency), 2, body)
+                report['modes'][name] = [drive(concurrency, args.duration, body) for concurrency in args.concurrency]
+            finally:
+                stop_container(container)
+
+    print("{:<10} {:>11} {:>12} {:>9} {:>9} {:>7}".format('mode', 'concurrency', 'requests/s', 'p50 ms', 'p99 ms', 'errors'))
+    for mode, results in report['modes'].items():
+        for result in results:
+            print("{:<10} {:>11} {:>12.1f} {:>9.2f} {:>9.2f} {:>7}".format(
+                mode, result['concurrency'], result['throughput'], result['p50_ms'] or 0, result['p99_ms'] or 0, result['errors']))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and p99 benchmark of the abalone serving modes and CPU quotas.")
+    parser.add_argument("--image", type=str, default="abalone:latest")
+    parser.add_argument("--model-dir", type=str, required=True)
+    parser.add_argument("--env", type=str, action="append", default=[], help="Container environment variable as KEY=VALUE")
+    parser.add_argument("--modes", type=str, nargs="+", default=["wsgi", "asgi"], help="Values of MODEL_SERVER_MODE to compare")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--cpus", type=float, nargs="+", default=[None],
+                        help="CPU quotas (docker --cpus) to compare, e.g. 1 2 4. The server sizes its workers and threads to the quota")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per concurrency level")
+    parser.add_argument("--rows", type=int, default=1, help="Records per request")
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--report", type=str, default=None, help="Path of the JSON report")
+    main(parser.parse_args())
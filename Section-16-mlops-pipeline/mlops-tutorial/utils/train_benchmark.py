@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+# Import the training module from the `model` folder
+utils_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(utils_path, '..', 'model'))
+import model
+
+default_data = os.path.join(utils_path, '..', 'tests', 'unit_test', 'input', 'data', 'training')
+
+
+def replicate(source, target, copies):
+    # Larger data set made of `copies` copies of a CSV file
+    with open(target, 'wb') as out:
+        for _ in range(copies):
+            with open(source, 'rb') as f:
+                shutil.copyfileobj(f, out)
+
+
+def parse_config(spec):
+    # 'key=value,key=value' hyperparameters, as strings like in a training job
+    return dict(item.split('=', 1) for item in spec.split(',') if item)
+
+
+def run(pipeline, train_path, validate_path, args, params):
+    """
+    Description:
+    ------------
+    Trains a fresh abalone model for a fixed number of epochs with one input pipeline
+    and one configuration of the execution options.
+
+    :pipeline: (str) 'memory' for the pandas arrays, 'stream' for the `tf.data` pipeline.
+    :train_path: (str) Training CSV file.
+    :validate_path: (str) Validation CSV file.
+    :args: (Namespace) Benchmark settings.
+    :params: (dict) Hyperparameters of the execution options, e.g. `jit_compile`.
+
+    :returns: (tuple) Seconds to load the data up front, and the throughput report.
+    """
+    batch_size = int(params.get('batch_size', args.batch_size))
+    model.set_precision(params)
+    network = model.build_model(args.layers, args.dense_layer)
+    model.compile_model(network, params, batch_size)
+    report = model.ThroughputReport(model.count_lines(train_path), params)
+    started = time.perf_counter()
+    if pipeline == 'stream':
+        # Parsing happens inside every epoch
+        load = 0.0
+        network.fit(model.make_dataset(train_path, batch_size, args.shuffle_buffer),
+                    validation_data=model.make_dataset(validate_path, batch_size),
+                    epochs=args.epochs, verbose=0, callbacks=[report])
+    else:
+        train_X, train_y = model.load_arrays(train_path)
+        val_X, val_y = model.load_arrays(validate_path)
+        load = time.perf_counter() - started
+        network.fit(train_X, train_y, validation_data=(val_X, val_y), batch_size=batch_size,
+                    epochs=args.epochs, shuffle=True, verbose=0, callbacks=[report])
+    return load, report
+
+
+def main(args):
+    tmp = tempfile.mkdtemp()
+    try:
+        train_path = os.path.join(tmp, 'train.csv')
+        replicate(os.path.join(args.data_dir, 'train.csv'), train_path, args.copies)
+        validate_path = os.path.join(args.data_dir, 'validate.csv')
+        report = {'copies': args.copies, 'epochs': args.epochs, 'batch_size': args.batch_size, 'results': []}
+        for config in args.config or ['']:
+            for pipeline in args.pipelines:
+                load, throughput = run(pipeline, train_path, validate_path, args, parse_config(config))
+                times = throughput.times
+                # The first epoch includes tracing the graph
+                report['results'].append({'pipeline': pipeline, 'config': config, 'load_s': load, 'first_epoch_s': times[0],
+                                          'median_epoch_s': float(np.median(times[1:] if len(times) > 1 else times)),
+                                          'total_s': load + sum(times), 'samples_per_sec': throughput.samples_per_sec,
+                                          'val_mae': min(throughput.val_mae)})
+    finally:
+        shutil.rmtree(tmp)
+
+    print("{:<8} {:>8} {:>15} {:>16} {:>9} {:>10} {:>8}  {}".format(
+        'pipeline', 'load s', 'first epoch s', 'median epoch s', 'total s', 'samples/s', 'val mae', 'config'))
+    for result in report['results']:
+        print("{:<8} {:>8.3f} {:>15.3f} {:>16.3f} {:>9.3f} {:>10.0f} {:>8.4f}  {}".format(
+            result['pipeline'], result['load_s'], result['first_epoch_s'], result['median_epoch_s'], result['total_s'],
+            result['samples_per_sec'], result['val_mae'], result['config'] or 'defaults'))
+    if args.report is not None:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Epoch time and throughput of the training input pipelines and execution options.")
+    parser.add_argument("--data-dir", type=str, default=default_data, help="Folder with train.csv and validate.csv")
+    parser.add_argument("--copies", type=int, default=10, help="Copies of train.csv to train on, to scale the data set")
+    parser.add_argument("--pipelines", type=str, nargs="+", default=["memory", "stream"])
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--shuffle-buffer", type=int, default=10000)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--dense-layer", type=int, default=64)
+    parser.add_argument("--config", type=str, action="append", default=None,
+                        help="Execution options as hyperparameters, e.g. 'batch_size=64,base_batch_size=8,jit_compile=true,"
+                             "steps_per_execution=16,mixed_precision=true', repeat to compare several")
+    parser.add_argument("--report", type=str, default=None, help="Path of the JSON report")
+    main(parser.parse_args())
@@ -0,0 +1,128 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+# Defaults: the training module and the unit test data set
+utils_path = os.path.dirname(os.path.abspath(__file__))
+model_dir = os.path.join(utils_path, '..', 'model')
+default_data = os.path.join(utils_path, '..', 'tests', 'unit_test', 'input', 'data', 'training')
+
+
+def free_ports(count):
+    # Ports the operating system has not handed out, one per emulated host
+    sockets = [socket.socket() for _ in range(count)]
+    for s in sockets:
+        s.bind(('localhost', 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def host_prefix(root, host, hosts, data_dir, hyperparameters):
+    """
+    Description:
+    ------------
+    Lays out the `/opt/ml` folder SageMaker prepares on one host of a training job.
+
+    :root: (str) Folder of the emulated hosts.
+    :host: (str) Name of this host.
+    :hosts: (list) Names of all the hosts, as `localhost:<port>`.
+    :data_dir: (str) Folder with train.csv and validate.csv.
+    :hyperparameters: (dict) Hyperparameters of the training job.
+
+    :returns: (str) The `/opt/ml` stand-in of the host.
+    """
+    prefix = os.path.join(root, 'algo-{}'.format(hosts.index(host) + 1))
+    for folder in ['input/config', 'input/data', 'model', 'output', 'checkpoints']:
+        os.makedirs(os.path.join(prefix, folder))
+    shutil.copytree(data_dir, os.path.join(prefix, 'input', 'data', 'training'))
+    with open(os.path.join(prefix, 'input', 'config', 'hyperparameters.json'), 'w') as f:
+        json.dump({key: str(value) for key, value in hyperparameters.items()}, f)
+    with open(os.path.join(prefix, 'input', 'config', 'resourceconfig.json'), 'w') as f:
+        json.dump({'current_host': host, 'hosts': hosts, 'network_interface_name': 'lo'}, f)
+    return prefix
+
+
+def run_host(prefix, threads):
+    # Runs in a fresh process: size the thread pools before TensorFlow is imported
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    sys.path.insert(0, model_dir)
+    import model
+    model.input_path = os.path.join(prefix, 'input', 'data')
+    model.output_path = os.path.join(prefix, 'output')
+    model.model_path = os.path.join(prefix, 'model')
+    model.param_path = os.path.join(prefix, 'input', 'config', 'hyperparameters.json')
+    model.input_config_path = os.path.join(prefix, 'input', 'config', 'inputdataconfig.json')
+    model.resource_config_path = os.path.join(prefix, 'input', 'config', 'resourceconfig.json')
+    model.checkpoint_path = os.path.join(prefix, 'checkpoints')
+    model.train()
+
+
+def main(args):
+    hyperparameters = {'epochs': args.epochs, 'layers': args.layers, 'dense_layer': args.dense_layer,
+                       'batch_size': args.batch_size, 'input_pipeline': args.input_pipeline}
+    if args.quantize is not None:
+        hyperparameters['quantize'] = args.quantize
+    hosts = ['localhost:{}'.format(port) for port in free_ports(args.workers)]
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    root = tempfile.mkdtemp()
+    try:
+        prefixes = [host_prefix(root, host, hosts, args.data_dir, hyperparameters) for host in hosts]
+        # Every emulated host is a separate process, like a container on its own instance
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=run_host, args=(prefix, threads)) for prefix in prefixes]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(args.timeout)
+        elapsed = time.perf_counter() - started
+
+        failures = []
+        for index, (process, prefix) in enumerate(zip(processes, prefixes)):
+            if process.is_alive():
+                process.terminate()
+                failures.append("algo-{} timed out".format(index + 1))
+            elif process.exitcode != 0:
+                failures.append("algo-{} exited with {}".format(index + 1, process.exitcode))
+            # Only the chief writes the model artifacts, `model.tflite` only if it stays accurate
+            artifacts = sorted(set(os.listdir(os.path.join(prefix, 'model'))) - {'model.tflite'})
+            expected = ['model.h5', 'model.npz'] if index == 0 else []
+            if index == 0 and args.quantize is not None:
+                expected.append('quantization.json')
+            if process.exitcode == 0 and artifacts != expected:
+                failures.append("algo-{} wrote {}, expected {}".format(index + 1, artifacts, expected))
+        if args.output is not None and not failures:
+            shutil.copytree(os.path.join(prefixes[0], 'model'), args.output, dirs_exist_ok=True)
+    finally:
+        shutil.rmtree(root)
+
+    print("{} workers trained in {:.1f} seconds".format(args.workers, elapsed))
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emulate a multi-host training job with one process per host.")
+    parser.add_argument("--workers", type=int, default=2, help="Number of emulated hosts")
+    parser.add_argument("--data-dir", type=str, default=default_data, help="Folder with train.csv and validate.csv")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--dense-layer", type=int, default=64)
+    parser.add_argument("--batch-size", type=int, default=8, help="Records per step on every worker")
+    parser.add_argument("--input-pipeline", type=str, choices=["memory", "stream"], default="memory")
+    parser.add_argument("--quantize", type=str, choices=["float16", "int8"], default=None,
+                        help="Also quantize the model on the chief")
+    parser.add_argument("--timeout", type=float, default=600, help="Seconds to wait for the workers")
+    parser.add_argument("--output", type=str, default=None, help="Folder to copy the chief's model artifacts to")
+    main(parser.parse_args())